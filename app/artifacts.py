@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import tempfile
+from dotenv import load_dotenv
+from assets import ASSET_BASE_URL, EXTERNAL_ASSETS
+from convert import EXTERNAL_ASSET_ARGS, PDF2HTMLEX_ARGS
+from metrics import registry
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Outputs and conversions stored under the PDF content hash, ARTIFACT_CACHE=0 turns it off
+ARTIFACT_CACHE = os.getenv("ARTIFACT_CACHE", "1") != "0"
+ARTIFACT_BUCKET = os.getenv("ARTIFACT_BUCKET") or os.getenv("OUT_BUCKET")
+RESULT_PREFIX = os.getenv("RESULT_PREFIX", "results/")
+CONVERSION_PREFIX = os.getenv("CONVERSION_PREFIX", "conversions/")
+
+# Conversions made with other pdf2htmlEX options or asset locations are not reused
+CONVERSION_OPTIONS = PDF2HTMLEX_ARGS + (EXTERNAL_ASSET_ARGS + [ASSET_BASE_URL] if EXTERNAL_ASSETS else [])
+CONVERSION_VERSION = hashlib.sha256(" ".join(CONVERSION_OPTIONS).encode("utf-8")).hexdigest()[:12]
+
+ARTIFACT_LOOKUPS = registry.counter(
+    "pdf_artifact_cache_lookups_total", "Content-addressed result and conversion lookups", ["kind", "outcome"],
+)
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def result_key(digest, from_lang, to_lang):
+    return f"{RESULT_PREFIX}{digest}/{from_lang}_{to_lang}.html"
+
+def conversion_key(digest):
+    return f"{CONVERSION_PREFIX}{digest}-{CONVERSION_VERSION}.html"
+
+def is_missing(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound")
+
+class ArtifactCache:
+    """Translated outputs and converter outputs of PDFs already processed, keyed by content hash"""
+
+    def __init__(self, client, bucket=ARTIFACT_BUCKET):
+        self.client = client
+        self.bucket = bucket
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception as e:
+            if is_missing(e):
+                return False
+            raise
+
+    def copy_result(self, digest, from_lang, to_lang, bucket, key):
+        """Copy a finished output to bucket/key, False when this PDF and pair was never translated"""
+        source = result_key(digest, from_lang, to_lang)
+        try:
+            found = self.exists(source)
+            if found:
+                self.client.copy_object(Bucket=bucket, Key=key, CopySource={"Bucket": self.bucket, "Key": source})
+        except Exception as e:
+            logger.warning(f"Result cache unavailable: {e}")
+            found = False
+        ARTIFACT_LOOKUPS.inc(kind="result", outcome="hit" if found else "miss")
+        if found:
+            logger.info(f"Reusing translated output {source} for {key}")
+        return found
+
+    def store_result(self, digest, from_lang, to_lang, bucket, key):
+        """Keep a copy of a finished output under its content address"""
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket, Key=result_key(digest, from_lang, to_lang),
+                CopySource={"Bucket": bucket, "Key": key},
+            )
+        except Exception as e:
+            logger.warning(f"Failed to store result of {key}: {e}")
+
+    def open_conversion(self, digest, dest_dir):
+        """Lines of a stored conversion of this PDF, or None"""
+        path = os.path.join(dest_dir, "cached.html")
+        try:
+            self.client.download_file(self.bucket, conversion_key(digest), path)
+        except Exception as e:
+            if not is_missing(e):
+                logger.warning(f"Conversion cache unavailable: {e}")
+            ARTIFACT_LOOKUPS.inc(kind="conversion", outcome="miss")
+            return None
+        ARTIFACT_LOOKUPS.inc(kind="conversion", outcome="hit")
+        logger.info(f"Reusing conversion {conversion_key(digest)}")
+        return read_lines(path)
+
+    def store_conversion(self, digest, lines, dest_dir):
+        """Pass converter lines through, uploading them once the conversion has finished successfully
+
+        The converter raises on a non-zero exit status, so a failed conversion
+        ends the loop with that error and is never uploaded.
+        """
+        spool = tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", dir=dest_dir, suffix=".html", delete=False)
+        try:
+            with spool:
+                for line in lines:
+                    spool.write(line)
+                    yield line
+            try:
+                self.client.upload_file(spool.name, self.bucket, conversion_key(digest))
+            except Exception as e:
+                logger.warning(f"Failed to store conversion of {digest}: {e}")
+        finally:
+            os.remove(spool.name)
+
+def read_lines(path):
+    with open(path, encoding="utf-8", newline="") as file:
+        yield from file
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+from dotenv import load_dotenv
+from metrics import registry
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Fonts and images are written as files by pdf2htmlEX and served from ASSET_BASE_URL instead of
+# being embedded as base64, which needs a public base URL for the bucket or its CDN
+EXTERNAL_ASSETS = os.getenv("EXTERNAL_ASSETS", "0") == "1" and bool(os.getenv("ASSET_BASE_URL"))
+ASSET_BASE_URL = (os.getenv("ASSET_BASE_URL") or "").rstrip("/")
+ASSET_BUCKET = os.getenv("ASSET_BUCKET") or os.getenv("OUT_BUCKET")
+ASSET_PREFIX = os.getenv("ASSET_PREFIX", "assets/")
+# Digests known to be in the bucket, forgotten once this many have been seen
+ASSET_MEMO_SIZE = int(os.getenv("ASSET_MEMO_SIZE", 10000))
+
+if os.getenv("EXTERNAL_ASSETS", "0") == "1" and not EXTERNAL_ASSETS:
+    logger.warning("EXTERNAL_ASSETS needs ASSET_BASE_URL, fonts and images stay embedded")
+
+ASSETS = registry.counter("pdf_assets_total", "Converter assets by whether they had to be uploaded", ["outcome"])
+ASSET_BYTES = registry.counter("pdf_asset_bytes_total", "Bytes of converter assets", ["outcome"])
+
+# Bare file names in src attributes and CSS url()s, as pdf2htmlEX writes them
+ASSET_REFERENCE = re.compile(
+    r"""(src="|url\(['"]?)([\w.-]+\.(?:woff2?|ttf|otf|eot|svg|png|jpe?g|gif|webp))""",
+    re.IGNORECASE,
+)
+CONTENT_TYPES = {".woff": "font/woff", ".woff2": "font/woff2", ".ttf": "font/ttf", ".otf": "font/otf"}
+
+_uploaded = set()
+_uploaded_lock = threading.Lock()
+
+class AssetStore:
+    """Fonts and images of one conversion, each unique file uploaded once under its content hash"""
+
+    def __init__(self, client, bucket=ASSET_BUCKET, prefix=ASSET_PREFIX, base_url=ASSET_BASE_URL):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.base_url = base_url
+        self.urls = {}
+
+    def url(self, path):
+        """Public URL of a local asset file, uploading it if the bucket does not have it yet"""
+        if path in self.urls:
+            return self.urls[path]
+        with open(path, "rb") as file:
+            data = file.read()
+        extension = os.path.splitext(path)[1].lower()
+        key = f"{self.prefix}{hashlib.sha256(data).hexdigest()}{extension}"
+        self.upload(key, data, extension)
+        self.urls[path] = f"{self.base_url}/{key}"
+        return self.urls[path]
+
+    def upload(self, key, data, extension):
+        with _uploaded_lock:
+            if key in _uploaded:
+                outcome = "reused"
+            else:
+                outcome = None
+        if outcome is None:
+            try:
+                self.client.head_object(Bucket=self.bucket, Key=key)
+                outcome = "existing"
+            except Exception as e:
+                if getattr(e, "response", {}).get("Error", {}).get("Code") not in ("NoSuchKey", "404", "NotFound"):
+                    raise
+                content_type = CONTENT_TYPES.get(extension) or mimetypes.guess_type(f"asset{extension}")[0]
+                self.client.put_object(
+                    Bucket=self.bucket, Key=key, Body=data,
+                    ContentType=content_type or "application/octet-stream",
+                    # Content-addressed, so it never changes
+                    CacheControl="public, max-age=31536000, immutable",
+                )
+                outcome = "uploaded"
+            with _uploaded_lock:
+                if len(_uploaded) >= ASSET_MEMO_SIZE:
+                    _uploaded.clear()
+                _uploaded.add(key)
+        ASSETS.inc(outcome=outcome)
+        ASSET_BYTES.inc(len(data), outcome=outcome)
+
+    def rewrite(self, text, directory):
+        """Point references to asset files of directory at their uploaded copies"""
+        def replace(match):
+            path = os.path.join(directory, match.group(2))
+            if not os.path.isfile(path):
+                return match.group(0)
+            return match.group(1) + self.url(path)
+        return ASSET_REFERENCE.sub(replace, text)
@@ -0,0 +1,89 @@
+import logging
+import os
+from time import monotonic
+from celery.worker.autoscale import Autoscaler
+from dotenv import load_dotenv
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# How often backend headroom is re-evaluated, and what counts as running out of it
+AUTOSCALE_INTERVAL = float(os.getenv("AUTOSCALE_INTERVAL", 30))
+AUTOSCALE_MAX_THROTTLED = float(os.getenv("AUTOSCALE_MAX_THROTTLED", 0.05))
+AUTOSCALE_MAX_FAILED = float(os.getenv("AUTOSCALE_MAX_FAILED", 0.2))
+AUTOSCALE_TARGET_LATENCY = float(os.getenv("AUTOSCALE_TARGET_LATENCY", 5))
+
+def backend_totals(snapshots):
+    """Request outcomes and summed latency of every backend across worker processes"""
+    merged = metrics.merge(snapshots)
+    totals = {"success": 0, "failure": 0, "throttled": 0, "seconds": 0.0, "timed": 0}
+    requests = merged.get(metrics.BACKEND_REQUESTS.name, {}).get("samples", {})
+    for (_, outcome), count in requests.items():
+        totals[outcome] = totals.get(outcome, 0) + count
+    latency = merged.get(metrics.BACKEND_SECONDS.name, {}).get("samples", {})
+    for value in latency.values():
+        totals["seconds"] += value[-2]
+        totals["timed"] += value[-1]
+    return totals
+
+class HeadroomAutoscaler(Autoscaler):
+    """Celery's queue-length autoscaler with a ceiling that follows translation backend headroom
+
+    Every AUTOSCALE_INTERVAL the backend requests made by all workers of this
+    host since the last check are looked at. Throttling, failures or slow
+    responses lower the ceiling by one process, a healthy interval raises it
+    again up to --autoscale's maximum.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ceiling = self.max_concurrency
+        self.last_check = monotonic()
+        self.last_totals = None
+
+    def adjust_ceiling(self):
+        totals = backend_totals(metrics.read_snapshots())
+        previous, self.last_totals = self.last_totals, totals
+        if previous is None:
+            return
+        delta = {key: totals[key] - previous.get(key, 0) for key in totals}
+        requests = delta["success"] + delta["failure"] + delta["throttled"]
+        if requests <= 0:
+            # Idle backends say nothing about headroom
+            return
+        throttled = delta["throttled"] / requests
+        failed = delta["failure"] / requests
+        latency = delta["seconds"] / delta["timed"] if delta["timed"] > 0 else 0.0
+        floor = max(self.min_concurrency, 1)
+        if throttled > AUTOSCALE_MAX_THROTTLED or failed > AUTOSCALE_MAX_FAILED or latency > AUTOSCALE_TARGET_LATENCY:
+            ceiling = max(floor, self.ceiling - 1)
+        else:
+            ceiling = min(self.max_concurrency, self.ceiling + 1)
+        if ceiling != self.ceiling:
+            logger.info(
+                f"Worker ceiling {self.ceiling} -> {ceiling} "
+                f"(throttled {throttled:.0%}, failed {failed:.0%}, latency {latency:.2f}s over {requests} requests)"
+            )
+            self.ceiling = ceiling
+
+    def _maybe_scale(self, req=None):
+        if monotonic() - self.last_check >= AUTOSCALE_INTERVAL:
+            self.last_check = monotonic()
+            try:
+                self.adjust_ceiling()
+            except Exception as e:
+                logger.warning(f"Failed to read backend headroom: {e}")
+        # The maximum may have been changed through remote control since
+        ceiling = min(self.ceiling, self.max_concurrency)
+        procs = self.processes
+        cur = min(self.qty, ceiling)
+        if cur > procs:
+            self.scale_up(cur - procs)
+            return True
+        cur = max(min(self.qty, ceiling), self.min_concurrency)
+        if cur < procs:
+            self.scale_down(procs - cur)
+            return True
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import aiohttp
+from dotenv import load_dotenv
+import local_model
+from clients import ClientPool, http_session
+from health import RateLimited
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Backends taking part in translation, built-in names or module:Class plugins
+TRANSLATION_BACKENDS = os.getenv("TRANSLATION_BACKENDS", "google,googletrans,mymemory")
+
+# Segments are joined with this separator when packed into one request
+BATCH_SEPARATOR = "\n"
+
+# Get email from environment variable or use default
+MYMEMORY_EMAIL = os.getenv("MYMEMORY_EMAIL", "your.email@example.com")
+
+def google_client(from_language, to_language):
+    # Imported on first use, worker processes that never call Google do not pay for it
+    from deep_translator import GoogleTranslator
+    return GoogleTranslator(source=from_language, target=to_language)
+
+def googletrans_client():
+    from googletrans import Translator
+    return Translator()
+
+# GoogleTranslator is bound to a language pair, a googletrans Translator serves every pair
+google_clients = ClientPool(google_client)
+googletrans_clients = ClientPool(googletrans_client)
+
+class Backend:
+    """A translation route and what it can take
+
+    Subclasses set their capabilities and implement translate(), which returns
+    the translation or None on failure and raises RateLimited when throttled.
+    """
+
+    name = None
+    # Largest payload (in UTF-8 bytes) accepted in one request, segments are packed up to it
+    max_chars = 4800
+    # Maximum in-flight requests per event loop
+    concurrency = 4
+    # Relative cost of a request, routes in equal health prefer the cheaper one
+    cost = 1.0
+    # (from, to) pairs it can translate, None for any pair
+    language_pairs = None
+
+    def supports(self, from_language, to_language):
+        return self.language_pairs is None or (from_language, to_language) in self.language_pairs
+
+    async def translate(self, text, from_language, to_language):
+        raise NotImplementedError
+
+    async def __call__(self, text, from_language, to_language):
+        return await self.translate(text, from_language, to_language)
+
+class GoogleBackend(Backend):
+    name = "google"
+    max_chars = 4800
+    concurrency = int(os.getenv("GOOGLE_CONCURRENCY", 8))
+
+    def call(self, text, from_language, to_language):
+        with google_clients.client(from_language, to_language) as translator:
+            return translator.translate(text)
+
+    async def translate(self, text, from_language, to_language):
+        from deep_translator.exceptions import TooManyRequests
+        try:
+            # deep_translator is blocking, run it off the event loop
+            result = await asyncio.to_thread(self.call, text, from_language, to_language)
+            return result
+        except TooManyRequests:
+            raise RateLimited("google")
+        except Exception as e:
+            logger.warning(f"Google Translator failed: {str(e)[:100]}...")
+            return None
+
+class GoogletransBackend(Backend):
+    name = "googletrans"
+    max_chars = 4800
+    concurrency = int(os.getenv("GOOGLETRANS_CONCURRENCY", 4))
+
+    def call(self, text, from_language, to_language):
+        with googletrans_clients.client() as translator:
+            return translator.translate(text, src=from_language, dest=to_language)
+
+    async def translate(self, text, from_language, to_language):
+        try:
+            # googletrans is blocking, run it off the event loop
+            translated = await asyncio.to_thread(self.call, text, from_language, to_language)
+            result = translated.text
+            return result
+        except Exception as e:
+            logger.warning(f"Googletrans failed: {str(e)[:100]}...")
+            return None
+
+class MyMemoryBackend(Backend):
+    name = "mymemory"
+    max_chars = 480  # MyMemory rejects queries over 500 bytes
+    concurrency = int(os.getenv("MYMEMORY_CONCURRENCY", 4))
+
+    def supports(self, from_language, to_language):
+        return from_language != "auto"
+
+    async def translate(self, text, from_language, to_language):
+        try:
+            # Use email from environment variable for higher quota
+            url = "https://api.mymemory.translated.net/get"
+            params = {"q": text, "langpair": f"{from_language}|{to_language}", "de": MYMEMORY_EMAIL}
+
+            # Add user-agent header to prevent blocking
+            headers = {
+                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36"
+            }
+
+            async with http_session().get(url, params=params, headers=headers) as response:
+                if response.status == 429:
+                    raise RateLimited("mymemory")
+                if response.status != 200:
+                    logger.warning(f"MyMemory API returned status code {response.status}")
+                    return None
+
+                data = await response.json(content_type=None)
+
+            # Check for rate limiting
+            if "responseStatus" in data and data["responseStatus"] == 429:
+                logger.warning("MyMemory API rate limit reached. Backing off.")
+                raise RateLimited("mymemory")
+
+            if data and "responseData" in data and "translatedText" in data["responseData"]:
+                result = data["responseData"]["translatedText"]
+
+                # Check quota
+                if "responseDetails" in data and "Daily request limit" in str(data["responseDetails"]):
+                    logger.warning(f"MyMemory API quota warning: {data['responseDetails']}")
+
+                return result
+            else:
+                logger.warning("MyMemory API returned invalid response structure")
+                return None
+
+        except asyncio.TimeoutError:
+            logger.warning("MyMemory API request timed out")
+            return None
+        except aiohttp.ClientError as e:
+            logger.warning(f"MyMemory API request failed: {str(e)[:100]}...")
+            return None
+        except RateLimited:
+            raise
+        except Exception as e:
+            logger.warning(f"MyMemory translation API failed: {str(e)[:100]}...")
+            return None
+
+class LocalBackend(Backend):
+    """Model running on this machine, each request is one batched inference in a process pool"""
+
+    name = "local"
+
+    def __init__(self, model_path=local_model.LOCAL_MODEL, workers=None):
+        self.model_path = model_path
+        self.workers = workers or int(os.getenv("LOCAL_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+        self.max_chars = int(os.getenv("LOCAL_MAX_CHARS", 20000))
+        self.concurrency = self.workers
+        self.cost = float(os.getenv("LOCAL_COST", 1.0))
+        # Read from the class, the model itself is only built in the worker processes
+        self.language_pairs = local_model.load_class(model_path).language_pairs
+        self.pool = None
+        self.pool_pid = None
+        self.lock = threading.Lock()
+
+    def executor(self):
+        """Process pool of this process, started on first use and again after a fork"""
+        with self.lock:
+            if self.pool is None or self.pool_pid != os.getpid():
+                # Spawned, forking a process that runs threads and event loops is not safe
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=local_model.load_model,
+                    initargs=(self.model_path,),
+                )
+                self.pool_pid = os.getpid()
+            return self.pool
+
+    async def translate(self, text, from_language, to_language):
+        # A packed chunk is a batch, every segment is one model input
+        segments = text.split(BATCH_SEPARATOR)
+        try:
+            future = self.executor().submit(local_model.translate_batch, segments, from_language, to_language)
+            translated = await asyncio.wrap_future(future)
+        except BrokenProcessPool as e:
+            logger.warning(f"Local model pool died, restarting it: {e}")
+            with self.lock:
+                self.pool = None
+            return None
+        except Exception as e:
+            logger.warning(f"Local model failed: {str(e)[:100]}...")
+            return None
+        return BATCH_SEPARATOR.join(translated)
+
+BUILTIN_BACKENDS = {
+    "google": GoogleBackend,
+    "googletrans": GoogletransBackend,
+    "mymemory": MyMemoryBackend,
+    "local": LocalBackend,
+}
+
+def load_backends(spec=TRANSLATION_BACKENDS):
+    """Backend instances by name, from built-in names and module:Class plugins"""
+    backends = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        backend_class = BUILTIN_BACKENDS.get(entry) or local_model.load_class(entry)
+        backend = backend_class()
+        backends[backend.name] = backend
+    return backends
@@ -0,0 +1,395 @@
+"""Offline throughput benchmark for the translation pipeline
+
+Translator backends are replaced by stubs with configurable latency, failure
+rate and rate limit, pdf2htmlEX by generated pages, and S3 and the database by
+local stand-ins, so nothing leaves the machine.
+
+    python bench.py --pages 100 --segments 40 --latency 0.05 --failure-rate 0.02
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+
+# Benchmarks always start cold and leave nothing behind for the workers of this host: no shared
+# on-disk cache or translation memory, no metrics snapshots feeding /metrics and the autoscaler,
+# and checkpoints in a directory of their own
+os.environ["TRANSLATION_CACHE_PATH"] = ""
+os.environ["TRANSLATION_MEMORY_PATH"] = ""
+os.environ["METRICS_DIR"] = ""
+os.environ["CHECKPOINT_DIR"] = tempfile.mkdtemp(prefix="bench-checkpoints-")
+
+import db
+import extract
+import prefilter
+import shard
+import task
+from backends import Backend, LocalBackend
+from cache import LRUTier, TranslationCache
+from health import BackendHealth, RateLimited, TokenBucket
+from singleflight import SingleFlight
+
+WORDS = (
+    "the pump valve pressure sensor manual install check warning figure table "
+    "connect power supply cable unit operating temperature range default mode"
+).split()
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class StageTimer:
+    """Collects latency samples per stage"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        return {
+            stage: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 0.50) * 1000,
+                "p90_ms": percentile(samples, 0.90) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+                "mean_ms": statistics.fmean(samples) * 1000,
+            }
+            for stage, samples in self.samples.items()
+        }
+
+class StubBackend(Backend):
+    """Translator stand-in with latency, random failures and its own rate limit"""
+
+    def __init__(self, name, timer, latency=0.05, jitter=0.5, failure_rate=0.0, rate_limit=None,
+                 max_chars=4800, concurrency=8, straggler_rate=0.0):
+        self.name = name
+        self.max_chars = max_chars
+        self.concurrency = concurrency
+        self.timer = timer
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.straggler_rate = straggler_rate
+        self.bucket = TokenBucket(rate_limit, max(1, int(rate_limit))) if rate_limit else None
+        self.calls = 0
+
+    async def translate(self, text, from_language, to_language):
+        self.calls += 1
+        start = time.perf_counter()
+        try:
+            if self.bucket and self.bucket.try_acquire():
+                raise RateLimited(self.name)
+            latency = self.latency * (1 + random.uniform(-self.jitter, self.jitter))
+            if random.random() < self.straggler_rate:
+                # A timeout or a retry on the service side
+                latency *= 20
+            await asyncio.sleep(latency)
+            if random.random() < self.failure_rate:
+                return None
+            return f"[{to_language}] {text}"
+        finally:
+            self.timer.record(f"backend:{self.name}", time.perf_counter() - start)
+
+class LocalStub(LocalBackend):
+    """Local backend running the glossary model, counted like the stubs"""
+
+    def __init__(self, timer, workers):
+        super().__init__("local_model:TinyModel", workers)
+        self.timer = timer
+        self.calls = 0
+
+    async def translate(self, text, from_language, to_language):
+        self.calls += 1
+        start = time.perf_counter()
+        try:
+            return await super().translate(text, from_language, to_language)
+        finally:
+            self.timer.record(f"backend:{self.name}", time.perf_counter() - start)
+
+class LocalS3:
+    """Local directory standing in for the S3 client used by task.py"""
+
+    def __init__(self, root):
+        self.root = root
+        self.uploads = {}
+
+    def path(self, bucket, key):
+        path = os.path.join(self.root, bucket or "bucket", key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def download_file(self, bucket, key, filename):
+        path = os.path.join(self.root, bucket or "bucket", key)
+        if os.path.exists(path):
+            shutil.copyfile(path, filename)
+            return
+        with open(filename, "wb") as file:
+            file.write(b"%PDF-1.4\n% benchmark placeholder\n")
+
+    def upload_file(self, filename, bucket, key):
+        shutil.copyfile(filename, self.path(bucket, key))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with open(self.path(Bucket, Key), "wb") as file:
+            file.write(Body)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        parts = self.uploads.pop(UploadId)
+        with open(self.path(Bucket, Key), "wb") as file:
+            for part in MultipartUpload["Parts"]:
+                file.write(parts[part["PartNumber"]])
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.uploads.pop(UploadId, None)
+        return {}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        root = os.path.join(self.root, Bucket or "bucket")
+        keys = []
+        for directory, _, names in os.walk(root):
+            for name in names:
+                key = os.path.relpath(os.path.join(directory, name), root)
+                if key.startswith(Prefix):
+                    keys.append(key)
+        yield {"Contents": [{"Key": key} for key in sorted(keys)]}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        for item in Delete["Objects"]:
+            os.remove(os.path.join(self.root, Bucket or "bucket", item["Key"]))
+        return {}
+
+def make_segment(rng, words):
+    kind = rng.random()
+    if kind < 0.15:
+        # Running headers and footers repeat on every page
+        return rng.choice(["Operating Manual", "Confidential", "Section 4 Maintenance"])
+    if kind < 0.25:
+        return str(rng.randint(1, 999))
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+def make_page(page_no, rng, segments=40, words=8, image_bytes=0):
+    """A page line shaped like pdf2htmlEX output"""
+    image = base64.b64encode(rng.randbytes(image_bytes)).decode() if image_bytes else ""
+    parts = [
+        f'<div id="pf{page_no:x}" class="pf w0 h0" data-page-no="{page_no:x}">',
+        '<div class="pc pc{0:x} w0 h0">'.format(page_no),
+    ]
+    if image:
+        parts.append(f'<img class="bi x0 y0 w1 h1" alt="" src="data:image/png;base64,{image}"/>')
+    for index in range(segments):
+        text = make_segment(rng, words)
+        parts.append(
+            f'<div class="t m0 x{index % 7:x} h2 y{index:x} ff1 fs0 fc0 sc0 ls0 ws0">'
+            f'{text}<span class="_ _{index % 3}"></span></div>'
+        )
+    parts.append('</div><div class="pi" data-data=\'{"ctm":[1.0,0.0,0.0,1.0,0.0,0.0]}\'></div></div>\n')
+    return "".join(parts)
+
+def make_document(pages, seed=1, **page_options):
+    """Header, page-container and footer lines of a generated document"""
+    rng = random.Random(seed)
+    yield '<!DOCTYPE html>\n'
+    yield '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+    yield '<head>\n<style type="text/css">\n'
+    yield '.ff1{font-family:ff1;line-height:1.0;}\n'
+    yield '.fs0{font-size:36.000000px;}\n'
+    yield '</style>\n</head>\n<body>\n'
+    yield '<div id="page-container">\n'
+    for page_no in range(1, pages + 1):
+        yield make_page(page_no, rng, **page_options)
+    yield '</div>\n</body>\n</html>\n'
+
+def install_backends(args, timer):
+    """Replace the real services with stubs and reset all shared state"""
+    backends = {}
+    for index in range(args.backends):
+        name = f"stub{index}"
+        backends[name] = StubBackend(
+            name, timer,
+            latency=args.latency * (1 + index * args.latency_spread),
+            failure_rate=args.failure_rate,
+            rate_limit=args.backend_rate_limit,
+            max_chars=args.max_chars,
+            concurrency=args.concurrency,
+            straggler_rate=args.straggler_rate,
+        )
+    if args.local_workers:
+        backends["local"] = LocalStub(timer, args.local_workers)
+    for name in backends:
+        extract.backend_health.backends[name] = BackendHealth(name, args.client_rate, max(1, int(args.client_rate)))
+    extract.methods = backends
+    extract.translation_cache = TranslationCache(tiers=[LRUTier()])
+    extract.in_flight = SingleFlight()
+    extract.translation_memory = None
+    prefilter.PREFILTER_SEGMENTS.values.clear()
+    extract.HEDGED.values.clear()
+    return backends
+
+def timed(timer, stage, function):
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            timer.record(stage, time.perf_counter() - start)
+    return wrapper
+
+async def bench_process_page(args, timer):
+    rng = random.Random(2)
+    lines = [
+        make_page(page_no, rng, segments=args.segments, words=args.words, image_bytes=args.image_kb * 1024)
+        for page_no in range(1, args.pages + 1)
+    ]
+    process_page = timed(timer, "process_page", extract.process_page)
+    start = time.perf_counter()
+    await asyncio.gather(*(process_page(line, "en", "fr") for line in lines))
+    return time.perf_counter() - start, len(lines)
+
+async def bench_translate_text(args, timer):
+    rng = random.Random(3)
+    texts = [make_segment(rng, args.words) for _ in range(args.pages * args.segments)]
+    translate_text = timed(timer, "translate_text", extract.translate_text)
+    start = time.perf_counter()
+    await asyncio.gather(*(translate_text(text, "en", "fr") for text in texts))
+    return time.perf_counter() - start, 0
+
+async def bench_pipeline(args, timer, workdir):
+    """Full task.main with generated conversion output, local S3 and a no-op database"""
+    options = {"segments": args.segments, "words": args.words, "image_bytes": args.image_kb * 1024}
+
+    def convert_pdf(input_pdf, dest_dir, pages=None, assets=None):
+        start = time.perf_counter()
+        for line in make_document(args.pages, **options):
+            yield line
+        timer.record("convert", time.perf_counter() - start)
+
+    task.s3 = LocalS3(workdir)
+    task.convert_pdf = convert_pdf
+    task.count_pages = lambda input_pdf: args.pages
+    # Every run measures the whole pipeline instead of reusing the previous output
+    task.artifact_cache = None
+    db.update = lambda status, pdf_key: timer.record(f"db:{status}", 0.0) or True
+    db.update_progress = lambda pdf_key, stage, pages_done, pages_total: True
+    extract.process_pages_multi = timed(timer, "translate_window", extract.process_pages_multi)
+
+    start = time.perf_counter()
+    if args.shard_pages:
+        # Chunks and the merge run in this process, one after another, as eager Celery tasks
+        task.app.conf.task_always_eager = True
+        task.SHARD_MIN_PAGES = 1
+        shard.SHARD_PAGES = args.shard_pages
+        await task.translate_pdf("en", ["fr"], "bench/document.pdf", shard=True)
+    else:
+        await task.main("en", "fr", "bench/document.pdf")
+    return time.perf_counter() - start, args.pages
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def report(args, name, elapsed, pages, timer, backends):
+    calls = sum(backend.calls for backend in backends.values())
+    segments = args.pages * args.segments
+    result = {
+        "scenario": name,
+        "seconds": elapsed,
+        "pages_per_sec": pages / elapsed if pages else None,
+        "segments_per_sec": segments / elapsed,
+        "backend_calls": calls,
+        "cache": dict(extract.translation_cache.stats),
+        "coalesced": extract.in_flight.stats["coalesced"],
+        "prefiltered": {
+            verdict: count for (verdict,), count in prefilter.PREFILTER_SEGMENTS.values.items() if verdict != "translate"
+        },
+        "hedged": sum(extract.HEDGED.values.values()),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": timer.summary(),
+    }
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"\n== {name}: {elapsed:.2f}s, {calls} backend calls, peak RSS {result['peak_rss_mb']:.1f} MB")
+    if pages:
+        print(f"   {result['pages_per_sec']:.2f} pages/sec, {result['segments_per_sec']:.1f} segments/sec")
+    else:
+        print(f"   {result['segments_per_sec']:.1f} segments/sec")
+    for stage, stats in sorted(result["stages"].items()):
+        print(
+            f"   {stage:<20} n={stats['count']:<6} p50={stats['p50_ms']:8.1f}ms "
+            f"p90={stats['p90_ms']:8.1f}ms p99={stats['p99_ms']:8.1f}ms"
+        )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["process_page", "translate_text", "pipeline", "all"], default="all")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--segments", type=int, default=40, help="text divs per page")
+    parser.add_argument("--words", type=int, default=8, help="words per segment")
+    parser.add_argument("--image-kb", type=int, default=0, help="inline background image per page")
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per backend call")
+    parser.add_argument("--latency-spread", type=float, default=0.5, help="extra latency of each further backend")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--straggler-rate", type=float, default=0.0, help="share of calls taking 20x the latency")
+    parser.add_argument("--backend-rate-limit", type=float, default=None, help="calls/sec before a stub answers 429")
+    parser.add_argument("--client-rate", type=float, default=1000.0, help="client side token bucket rate")
+    parser.add_argument("--concurrency", type=int, default=8, help="in-flight calls per backend")
+    parser.add_argument("--max-chars", type=int, default=4800, help="payload limit of each backend")
+    parser.add_argument("--local-workers", type=int, default=0, help="add the local glossary model with this many processes")
+    parser.add_argument("--shard-pages", type=int, default=0, help="run the pipeline sharded into chunks of this many pages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="one JSON line per scenario")
+    return parser.parse_args()
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    scenarios = {
+        "process_page": bench_process_page,
+        "translate_text": bench_translate_text,
+        "pipeline": lambda args, timer: bench_pipeline(args, timer, workdir),
+    }
+    original_process_pages_multi = extract.process_pages_multi
+    try:
+        for name, scenario in scenarios.items():
+            if args.scenario not in ("all", name):
+                continue
+            timer = StageTimer()
+            backends = install_backends(args, timer)
+            extract.process_pages_multi = original_process_pages_multi
+            elapsed, pages = await scenario(args, timer)
+            report(args, name, elapsed, pages, timer, backends)
+    finally:
+        extract.process_pages_multi = original_process_pages_multi
+        await extract.close_http_session()
+        shutil.rmtree(workdir, ignore_errors=True)
+        shutil.rmtree(os.environ["CHECKPOINT_DIR"], ignore_errors=True)
+
+if __name__ == "__main__":
+    args = parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
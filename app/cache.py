@@ -0,0 +1,215 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Shared on-disk tier, set TRANSLATION_CACHE_PATH to an empty string to disable it
+CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", os.path.join(tempfile.gettempdir(), "translation_cache.sqlite3"))
+CACHE_MEMORY_ITEMS = int(os.getenv("TRANSLATION_CACHE_MEMORY_ITEMS", 20000))
+CACHE_DISK_ITEMS = int(os.getenv("TRANSLATION_CACHE_DISK_ITEMS", 2000000))
+CACHE_TTL = float(os.getenv("TRANSLATION_CACHE_TTL", 30 * 24 * 3600))
+
+# SQLite limits the number of parameters in a single statement
+SQLITE_MAX_PARAMS = 900
+
+def cache_key(text, from_language, to_language, backend):
+    """Hash of everything that identifies a translation"""
+    raw = "\x1f".join((text, from_language, to_language, backend))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class LRUTier:
+    """Bounded in-process tier with least recently used eviction"""
+
+    def __init__(self, max_items=CACHE_MEMORY_ITEMS, ttl=CACHE_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                item = self.items.get(key)
+                if item is None:
+                    continue
+                value, expires_at = item
+                if expires_at < now:
+                    del self.items[key]
+                    continue
+                self.items.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, values):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            for key, value in values.items():
+                self.items[key] = (value, expires_at)
+                self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def __len__(self):
+        return len(self.items)
+
+class SQLiteTier:
+    """Tier shared by every worker process on the host through one SQLite file"""
+
+    def __init__(self, path=CACHE_PATH, max_items=CACHE_DISK_ITEMS, ttl=CACHE_TTL, prune_every=1000):
+        self.path = path
+        self.max_items = max_items
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.writes = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def connection(self):
+        # Connections must not cross a fork, so they are per process and per thread
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS translations_created ON translations (created_at)")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get_many(self, keys):
+        found = {}
+        now = time.time()
+        conn = self.connection()
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            batch = keys[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT key, value FROM translations WHERE key IN ({placeholders}) AND expires_at >= ?",
+                (*batch, now),
+            )
+            found.update(rows)
+        return found
+
+    def set_many(self, values):
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO translations (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                [(key, value, now, now + self.ttl) for key, value in values.items()],
+            )
+        with self.lock:
+            self.writes += len(values)
+            prune = self.writes >= self.prune_every
+            if prune:
+                self.writes = 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Drop expired rows, then the oldest rows beyond the size limit"""
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM translations WHERE expires_at < ?", (time.time(),))
+            count, = conn.execute("SELECT COUNT(*) FROM translations").fetchone()
+            if count > self.max_items:
+                conn.execute(
+                    "DELETE FROM translations WHERE key IN "
+                    "(SELECT key FROM translations ORDER BY created_at LIMIT ?)",
+                    (count - self.max_items,),
+                )
+
+    def __len__(self):
+        count, = self.connection().execute("SELECT COUNT(*) FROM translations").fetchone()
+        return count
+
+class TranslationCache:
+    """Tiered translation cache, lookups go front to back and hits are promoted"""
+
+    def __init__(self, tiers=None):
+        if tiers is None:
+            tiers = [LRUTier()]
+            if CACHE_PATH:
+                tiers.append(SQLiteTier())
+        self.tiers = tiers
+        self.stats = {"hits": 0, "misses": 0, "tier_hits": [0] * len(tiers), "errors": 0}
+        self.lock = threading.Lock()
+
+    def get_many(self, texts, from_language, to_language, backends):
+        """Look up texts translated by any of the backends, returns {text: translation}"""
+        keys = {}
+        for text in texts:
+            for backend in backends:
+                keys[cache_key(text, from_language, to_language, backend)] = text
+
+        found = {}
+        missing = list(keys)
+        for index, tier in enumerate(self.tiers):
+            if not missing:
+                break
+            try:
+                values = tier.get_many(missing)
+            except Exception as e:
+                self.record_error("read", e)
+                continue
+            if not values:
+                continue
+            # Promote lower tier hits into the tiers in front of them
+            for front in self.tiers[:index]:
+                front.set_many(values)
+            with self.lock:
+                self.stats["tier_hits"][index] += len({keys[key] for key in values} - set(found))
+            for key, value in values.items():
+                found.setdefault(keys[key], value)
+            missing = [key for key in missing if keys[key] not in found]
+
+        with self.lock:
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(set(texts)) - len(found)
+        return found
+
+    def get(self, text, from_language, to_language, backends):
+        return self.get_many([text], from_language, to_language, backends).get(text)
+
+    def set_many(self, translations, from_language, to_language, backend):
+        """Store {text: translation} pairs produced by a backend in every tier"""
+        values = {
+            cache_key(text, from_language, to_language, backend): value
+            for text, value in translations.items()
+        }
+        if not values:
+            return
+        for tier in self.tiers:
+            try:
+                tier.set_many(values)
+            except Exception as e:
+                self.record_error("write", e)
+
+    def set(self, text, from_language, to_language, backend, value):
+        self.set_many({text: value}, from_language, to_language, backend)
+
+    def record_error(self, action, error):
+        with self.lock:
+            self.stats["errors"] += 1
+        logger.warning(f"Translation cache {action} failed: {str(error)[:100]}...")
+
+    def hit_ratio(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from dotenv import load_dotenv
+from metrics import registry
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Translated pages are spooled locally, or to the object store when CHECKPOINT_BUCKET is set
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT", "1") != "0"
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "pdf_checkpoints"))
+CHECKPOINT_BUCKET = os.getenv("CHECKPOINT_BUCKET")
+CHECKPOINT_PREFIX = os.getenv("CHECKPOINT_PREFIX", "checkpoints/")
+# Local spools of documents that never finished are removed after this many seconds
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", 7 * 24 * 3600))
+
+CHECKPOINT_PAGES = registry.counter(
+    "pdf_checkpoint_pages_total", "Translated pages saved to or reused from checkpoints", ["outcome"],
+)
+
+PAGE_ID = re.compile(r'<div id="(pf[0-9a-f]+)"')
+
+def page_name(line):
+    """Name of a page's checkpoint, tied to the exact converter output of that page"""
+    match = PAGE_ID.match(line)
+    page_id = match.group(1) if match else "page"
+    return f"{page_id}-{hashlib.sha256(line.encode('utf-8')).hexdigest()[:24]}.html"
+
+class LocalStore:
+    """Checkpoints in a local spool directory"""
+
+    def __init__(self, root=CHECKPOINT_DIR):
+        self.root = root
+
+    def names(self, prefix):
+        try:
+            return set(os.listdir(os.path.join(self.root, prefix)))
+        except FileNotFoundError:
+            return set()
+
+    def get(self, prefix, name):
+        try:
+            with open(os.path.join(self.root, prefix, name), encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, prefix, name, text):
+        directory = os.path.join(self.root, prefix)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(f"{path}.tmp", path)
+
+    def delete(self, prefix):
+        shutil.rmtree(os.path.join(self.root, prefix), ignore_errors=True)
+
+    def prune(self, ttl=CHECKPOINT_TTL):
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - ttl
+        for prefix in os.listdir(self.root):
+            path = os.path.join(self.root, prefix)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+class S3Store:
+    """Checkpoints in the object store, shared by every worker"""
+
+    def __init__(self, client, bucket, prefix=CHECKPOINT_PREFIX):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def keys(self, prefix):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}{prefix}/"):
+            for item in page.get("Contents", []):
+                yield item["Key"]
+
+    def names(self, prefix):
+        return {key.rsplit("/", 1)[-1] for key in self.keys(prefix)}
+
+    def get(self, prefix, name):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{prefix}/{name}")
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+        return response["Body"].read().decode("utf-8")
+
+    def put(self, prefix, name, text):
+        self.client.put_object(Bucket=self.bucket, Key=f"{self.prefix}{prefix}/{name}", Body=text.encode("utf-8"))
+
+    def delete(self, prefix):
+        keys = list(self.keys(prefix))
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True},
+            )
+
+    def prune(self, ttl=CHECKPOINT_TTL):
+        # Expiry of abandoned checkpoints is left to the bucket's lifecycle rules
+        pass
+
+def checkpoint_store(s3_client):
+    if CHECKPOINT_BUCKET:
+        return S3Store(s3_client, CHECKPOINT_BUCKET)
+    return LocalStore()
+
+class Checkpoint:
+    """Translated pages of one document and language pair, kept until the output is uploaded
+
+    Pages are keyed by the PDF content hash and their converter output, so a
+    retried task finds them whatever the S3 key or worker. Checkpoint errors are
+    logged and never fail the task, the pages are translated again instead.
+    """
+
+    def __init__(self, store, from_lang, to_lang):
+        self.store = store
+        self.from_lang = from_lang
+        self.to_lang = to_lang
+        self.prefix = None
+        self.existing = set()
+
+    def open(self, digest):
+        """Find the checkpoint of a PDF by its content hash, blocking"""
+        try:
+            self.store.prune()
+            self.prefix = f"{digest}-{self.from_lang}_{self.to_lang}"
+            self.existing = self.store.names(self.prefix)
+        except Exception as e:
+            logger.warning(f"Checkpoints unavailable: {e}")
+            self.prefix = None
+            return
+        if self.existing:
+            logger.info(f"Resuming from checkpoint {self.prefix} with {len(self.existing)} pages")
+
+    async def load_many(self, lines):
+        """{index: translated page} of the lines already translated by an earlier run"""
+        if not self.prefix or not self.existing:
+            return {}
+        found = [(index, page_name(line)) for index, line in enumerate(lines) if line[:11] == "<div id=\"pf"]
+        found = [(index, name) for index, name in found if name in self.existing]
+        if not found:
+            return {}
+        try:
+            pages = await asyncio.gather(*(
+                asyncio.to_thread(self.store.get, self.prefix, name) for _, name in found
+            ))
+        except Exception as e:
+            logger.warning(f"Failed to read checkpoint {self.prefix}: {e}")
+            return {}
+        loaded = {index: page for (index, _), page in zip(found, pages) if page is not None}
+        CHECKPOINT_PAGES.inc(len(loaded), outcome="reused")
+        return loaded
+
+    async def save_many(self, pages):
+        """Persist (source line, translated page) pairs"""
+        if not self.prefix or not pages:
+            return
+        try:
+            await asyncio.gather(*(
+                asyncio.to_thread(self.store.put, self.prefix, page_name(line), translated)
+                for line, translated in pages
+            ))
+            CHECKPOINT_PAGES.inc(len(pages), outcome="saved")
+        except Exception as e:
+            logger.warning(f"Failed to write checkpoint {self.prefix}: {e}")
+
+    async def clear(self):
+        if not self.prefix:
+            return
+        try:
+            await asyncio.to_thread(self.store.delete, self.prefix)
+        except Exception as e:
+            logger.warning(f"Failed to remove checkpoint {self.prefix}: {e}")
@@ -0,0 +1,90 @@
+import asyncio
+import contextlib
+import os
+import threading
+import weakref
+import aiohttp
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Keep-alive connections of the http session of each event loop
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 100))
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", 32))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", 30))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+
+# Idle blocking clients kept per key, more are built when more threads need one at once
+CLIENT_POOL_IDLE = int(os.getenv("CLIENT_POOL_IDLE", 8))
+
+# Http sessions belong to the event loop that created them
+_loop_sessions = weakref.WeakKeyDictionary()
+
+def http_session():
+    """Shared aiohttp session of the running loop, reusing its connections across requests"""
+    loop = asyncio.get_running_loop()
+    session = _loop_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_SIZE, limit_per_host=HTTP_POOL_PER_HOST, keepalive_timeout=HTTP_KEEPALIVE,
+        )
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+        _loop_sessions[loop] = session
+    return session
+
+async def close_http_session():
+    """Close the http session of the running loop, call once per document"""
+    session = _loop_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+class ClientPool:
+    """Blocking clients built by factory(*key) and reused, each used by one thread at a time
+
+    Clients left over from a parent process are dropped after a fork, and a
+    client whose call raised is not given back.
+    """
+
+    def __init__(self, factory, max_idle=CLIENT_POOL_IDLE):
+        self.factory = factory
+        self.max_idle = max_idle
+        self.idle = {}
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def client(self, *key):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.idle = {}
+                self.pid = os.getpid()
+            idle = self.idle.setdefault(key, [])
+            client = idle.pop() if idle else None
+        if client is None:
+            client = self.factory(*key)
+        yield client
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(client)
+
+class ProcessLocal:
+    """Proxy to an object built on first use in each process, nothing made before a fork is shared"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._object = self._factory()
+                    self._pid = os.getpid()
+        return self._object
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
@@ -0,0 +1,214 @@
+import concurrent.futures
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+from dotenv import load_dotenv
+from metrics import add_stage_time
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PDF2HTMLEX_ARGS = ["--tounicode", "1", "--optimize-text", "0"]
+# Fonts and images written next to the output instead of embedded, CSS stays inline for shrink_font
+EXTERNAL_ASSET_ARGS = ["--embed-font", "0", "--embed-image", "0"]
+
+# Parallel conversion, a range is converted by its own pdf2htmlEX process
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", os.cpu_count() or 1))
+CONVERT_MIN_PAGES_PER_RANGE = int(os.getenv("CONVERT_MIN_PAGES_PER_RANGE", 20))
+
+PAGE_CONTAINER = "<div id=\"page-container\">"
+
+# pdf2htmlEX numbers these classes per run, so ranges reuse the same names for different styles
+NUMBERED_CLASS = re.compile(r"^(ff|fs|fc|sc|ls|ws|lh|v|x|y|h|w|m|c|_)([0-9a-f]+)$")
+NUMBERED_SELECTOR = re.compile(r"\.(ff|fs|fc|sc|ls|ws|lh|v|x|y|h|w|m|c|_)([0-9a-f]+)\b")
+FONT_FAMILY = re.compile(r"font-family:\s*ff([0-9a-f]+)\b")
+CLASS_ATTRIBUTE = re.compile(r'class="([^"]*)"')
+STYLE_BLOCK = re.compile(r"<style type=\"text/css\">.*?</style>\n?", re.DOTALL)
+
+def count_pages(input_pdf):
+    """Number of pages of a PDF, or None when it cannot be told cheaply"""
+    if shutil.which("pdfinfo"):
+        try:
+            info = subprocess.run(["pdfinfo", input_pdf], capture_output=True, text=True, timeout=30)
+            match = re.search(r"^Pages:\s+(\d+)", info.stdout, re.MULTILINE)
+            if match:
+                return int(match.group(1))
+        except (OSError, subprocess.SubprocessError):
+            pass
+    # Fall back to the page tree root, which is missing when it sits in a compressed object stream
+    with open(input_pdf, "rb") as file:
+        data = file.read()
+    counts = [int(count) for count in re.findall(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)", data)]
+    counts += [int(count) for count in re.findall(rb"/Count\s+(\d+)[^>]*?/Type\s*/Pages\b", data)]
+    if not counts:
+        # Parallel conversion, progress totals and sharding all need the count
+        logger.warning(f"Could not count the pages of {input_pdf}, is pdfinfo installed?")
+        return None
+    return max(counts)
+
+def page_ranges(pages, workers=CONVERT_WORKERS, min_pages=CONVERT_MIN_PAGES_PER_RANGE):
+    """Split pages 1..pages into at most `workers` ranges of at least `min_pages`"""
+    count = max(1, min(workers, pages // max(min_pages, 1)))
+    size, extra = divmod(pages, count)
+    ranges = []
+    first = 1
+    for index in range(count):
+        last = first + size - 1 + (1 if index < extra else 0)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+def follow_conversion(process, output_html, poll_interval=0.2):
+    """Yield complete lines of the converter output while it is still being written"""
+    while not os.path.exists(output_html):
+        if process.poll() is not None:
+            raise RuntimeError(f"pdf2htmlEX exited with code {process.returncode} without output")
+        time.sleep(poll_interval)
+    with open(output_html, "r", encoding="utf-8") as file:
+        partial = ""
+        while True:
+            line = file.readline()
+            if line:
+                partial += line
+                if partial.endswith("\n"):
+                    yield partial
+                    partial = ""
+                continue
+            if process.poll() is not None:
+                # Converter finished, drain whatever it wrote last
+                for line in file:
+                    partial += line
+                    if partial.endswith("\n"):
+                        yield partial
+                        partial = ""
+                if partial:
+                    yield partial
+                return
+            time.sleep(poll_interval)
+
+def convert_streaming(input_pdf, dest_dir, args=PDF2HTMLEX_ARGS):
+    """Run one pdf2htmlEX over the whole document, yielding lines as they are written"""
+    process = subprocess.Popen(["pdf2htmlEX", *args, "--dest-dir", dest_dir, input_pdf, "output.html"])
+    try:
+        # Lines are handed on as soon as pdf2htmlEX writes them
+        yield from follow_conversion(process, os.path.join(dest_dir, "output.html"))
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    # A crashed or killed converter leaves truncated output, which must not be translated or cached
+    if process.returncode != 0:
+        raise RuntimeError(f"pdf2htmlEX exited with code {process.returncode}")
+
+def convert_range(input_pdf, dest_dir, first, last, args=PDF2HTMLEX_ARGS):
+    """Convert pages first..last into their own directory"""
+    os.makedirs(dest_dir, exist_ok=True)
+    subprocess.run(
+        ["pdf2htmlEX", *args, "-f", str(first), "-l", str(last), "--dest-dir", dest_dir, input_pdf, "output.html"],
+        check=True,
+    )
+    return os.path.join(dest_dir, "output.html")
+
+def split_output(output_html):
+    """Split converter output into header, page and footer lines"""
+    header, pages, footer = [], [], []
+    with open(output_html, "r", encoding="utf-8") as file:
+        lines = iter(file)
+        for line in lines:
+            header.append(line)
+            if line.strip() == PAGE_CONTAINER:
+                break
+        for line in lines:
+            if line.startswith("<div id=\"pf"):
+                pages.append(line)
+            else:
+                footer.append(line)
+                break
+        footer.extend(lines)
+    return header, pages, footer
+
+def rename_classes(text, suffix, html=True):
+    """Give the numbered classes of one range names that cannot clash with another range"""
+    def rename(prefix, number):
+        return f"{prefix}{number}{suffix}"
+
+    text = NUMBERED_SELECTOR.sub(lambda m: "." + rename(m.group(1), m.group(2)), text)
+    text = FONT_FAMILY.sub(lambda m: "font-family:" + rename("ff", m.group(1)), text)
+    if html:
+        def rename_attribute(match):
+            names = []
+            for name in match.group(1).split():
+                numbered = NUMBERED_CLASS.match(name)
+                names.append(rename(*numbered.groups()) if numbered else name)
+            return f'class="{" ".join(names)}"'
+        text = CLASS_ATTRIBUTE.sub(rename_attribute, text)
+    return text
+
+def stitch(outputs, assets=None):
+    """Merge the outputs of consecutive page ranges into one document"""
+    def localize(text, output_html):
+        # Every range writes its own f1.woff, bg1.png, ... so files are resolved per range
+        return assets.rewrite(text, os.path.dirname(output_html)) if assets else text
+
+    header, pages, footer = split_output(outputs[0])
+    head = "".join(header)
+    base_styles = set(STYLE_BLOCK.findall(head))
+    head = localize(head, outputs[0])
+    pages = [localize(page, outputs[0]) for page in pages]
+    extra_styles = []
+    for index, output_html in enumerate(outputs[1:], start=1):
+        range_header, range_pages, _ = split_output(output_html)
+        suffix = f"r{index}"
+        # Shared base styles are kept once, per-run styles are namespaced
+        for block in STYLE_BLOCK.findall("".join(range_header)):
+            renamed = rename_classes(block, suffix, html=False)
+            if renamed != block or block not in base_styles:
+                extra_styles.append(localize(renamed, output_html))
+        pages.extend(localize(rename_classes(page, suffix), output_html) for page in range_pages)
+
+    if extra_styles:
+        if "</head>" not in head:
+            raise RuntimeError("Converter output has no </head> to merge styles into")
+        before, after = head.split("</head>", 1)
+        head = before + "".join(extra_styles) + "</head>" + after
+    yield from head.splitlines(keepends=True)
+    yield from pages
+    yield from footer
+
+def convert_parallel(input_pdf, dest_dir, ranges, workers=CONVERT_WORKERS, args=PDF2HTMLEX_ARGS, assets=None):
+    """Convert page ranges side by side and stitch them back together"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(convert_range, input_pdf, os.path.join(dest_dir, f"range{index}"), first, last, args)
+            for index, (first, last) in enumerate(ranges)
+        ]
+        outputs = [future.result() for future in futures]
+    yield from stitch(outputs, assets)
+
+def convert_pdf(input_pdf, dest_dir, pages=None, assets=None):
+    """Yield the html lines of a PDF, converting page ranges in parallel when it pays off
+
+    With an AssetStore fonts and images are uploaded on their own and the lines
+    reference them by URL instead of carrying them as base64.
+    """
+    start_processing = time.perf_counter()
+    args = PDF2HTMLEX_ARGS + EXTERNAL_ASSET_ARGS if assets else PDF2HTMLEX_ARGS
+    if pages is None and CONVERT_WORKERS > 1:
+        pages = count_pages(input_pdf)
+    ranges = page_ranges(pages) if pages else [(1, None)]
+    if len(ranges) > 1:
+        logger.info(f"Converting {pages} pages as {len(ranges)} ranges in parallel")
+        yield from convert_parallel(input_pdf, dest_dir, ranges, args=args, assets=assets)
+    elif assets:
+        for line in convert_streaming(input_pdf, dest_dir, args):
+            yield assets.rewrite(line, dest_dir)
+    else:
+        yield from convert_streaming(input_pdf, dest_dir)
+    elapsed = time.perf_counter() - start_processing
+    add_stage_time("convert", elapsed)
+    logger.info(f"pdf convertion to html in {elapsed:.2f} seconds")
@@ -1,29 +1,178 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
 import psycopg2
+import psycopg2.errors
+import psycopg2.pool
 from dotenv import load_dotenv
-import os
 
 # Load environment variables from .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Fetch variables
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 4))
+
+# Status writes are retried with a growing delay, without blocking the event loop
+DB_RETRIES = int(os.getenv("DB_RETRIES", 10))
+DB_RETRY_DELAY = float(os.getenv("DB_RETRY_DELAY", 0.5))
+DB_RETRY_MAX_DELAY = float(os.getenv("DB_RETRY_MAX_DELAY", 5))
+
+# Progress is written at most this often per document, set DB_PROGRESS=0 to turn it off
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 2))
+PROGRESS_ENABLED = os.getenv("DB_PROGRESS", "1") != "0"
+
+# Columns read by clients polling progress, apply with `python db.py migrate`
+PROGRESS_COLUMNS = """
+ALTER TABLE public.pdf
+    ADD COLUMN IF NOT EXISTS stage text,
+    ADD COLUMN IF NOT EXISTS pages_done integer,
+    ADD COLUMN IF NOT EXISTS pages_total integer,
+    ADD COLUMN IF NOT EXISTS progress_updated_at timestamptz;
+"""
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Connection pool of this process, created again after a fork"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Connections inherited from the parent process must not be shared
+            _pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL)
+            _pool_pid = os.getpid()
+        return _pool
+
+def execute(query, params):
+    """Run one statement on a pooled connection and commit it"""
+    pool = get_pool()
+    connection = pool.getconn()
+    broken = False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+        connection.commit()
+    except Exception:
+        broken = connection.closed != 0
+        if not broken:
+            connection.rollback()
+        raise
+    finally:
+        pool.putconn(connection, close=broken)
 
 def update(status, pdf_id):
     """
     Update the status of a PDF in the database by pdf_id.
     """
     try:
-        connection = psycopg2.connect(DATABASE_URL)
-        cursor = connection.cursor()
-        cursor.execute(
-            "UPDATE public.pdf SET status = %s WHERE pdf_key = %s;",
-            (status, pdf_id)
+        execute("UPDATE public.pdf SET status = %s WHERE pdf_key = %s;", (status, pdf_id))
+        logger.info(f"Status of {pdf_id} set to {status}")
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to update: {e}")
+        return False
+
+async def set_status(status, pdf_id, retries=DB_RETRIES):
+    """Update the status in a thread, retrying with backoff on the event loop"""
+    delay = DB_RETRY_DELAY
+    for attempt in range(retries):
+        if await asyncio.to_thread(update, status, pdf_id):
+            return True
+        if attempt + 1 < retries:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, DB_RETRY_MAX_DELAY)
+    logger.error(f"Giving up setting status {status} for {pdf_id} after {retries} attempts")
+    return False
+
+def update_progress(pdf_id, stage, pages_done, pages_total):
+    """Write the progress columns, turned off for the process when they do not exist"""
+    global PROGRESS_ENABLED
+    if not PROGRESS_ENABLED:
+        return True
+    try:
+        execute(
+            "UPDATE public.pdf SET stage = %s, pages_done = %s, pages_total = %s, "
+            "progress_updated_at = now() WHERE pdf_key = %s;",
+            (stage, pages_done, pages_total, pdf_id),
         )
-        connection.commit()
-        cursor.close()
-        connection.close()
-        print("Update successful!")
+        return True
+    except psycopg2.errors.UndefinedColumn:
+        logger.warning("Progress columns are missing, run `python db.py migrate` to enable progress updates")
+        PROGRESS_ENABLED = False
         return True
     except Exception as e:
-        print(f"Failed to update: {e}")
-        return False
\ No newline at end of file
+        logger.warning(f"Failed to update progress: {e}")
+        return False
+
+class ProgressReporter:
+    """Stage and page counts of a document, written in the background at most every `interval` seconds
+
+    The setters only touch memory and may be called from any thread.
+    """
+
+    def __init__(self, pdf_id, interval=PROGRESS_INTERVAL):
+        self.pdf_id = pdf_id
+        self.interval = interval
+        self.stage = None
+        self.pages_done = 0
+        self.pages_total = None
+        self.version = 0
+        self.written = 0
+        self.lock = threading.Lock()
+        self.task = None
+
+    def set_stage(self, stage):
+        with self.lock:
+            self.stage = stage
+            self.version += 1
+
+    def set_total(self, pages):
+        with self.lock:
+            self.pages_total = pages
+            self.version += 1
+
+    def add_pages(self, count):
+        if count:
+            with self.lock:
+                self.pages_done += count
+                self.version += 1
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write the latest state if it changed since the last write"""
+        with self.lock:
+            if self.version == self.written:
+                return
+            version = self.version
+            values = (self.stage, self.pages_done, self.pages_total)
+        if await asyncio.to_thread(update_progress, self.pdf_id, *values):
+            self.written = version
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        execute(PROGRESS_COLUMNS, None)
+        print("Progress columns are in place")
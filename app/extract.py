@@ -1,13 +1,20 @@
 import time
 import asyncio
 import os
-from bs4 import BeautifulSoup as bs4
+import weakref
+import collections
+import contextvars
 import logging
-from deep_translator import GoogleTranslator
-from googletrans import Translator
-import requests
-import random
 from dotenv import load_dotenv
+from backends import BATCH_SEPARATOR, load_backends
+from clients import close_http_session
+from cache import TranslationCache
+from translation_memory import TM_PATH, TranslationMemory
+from health import HedgeBudget, HealthRegistry, RateLimited
+from singleflight import SingleFlight
+from prefilter import passthrough
+from metrics import BACKEND_IN_FLIGHT, BACKEND_REQUESTS, BACKEND_SECONDS, registry, span
+from rewriter import parse_page
 
 
 # Load environment variables
@@ -17,237 +24,433 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Translation cache to avoid duplicate translations
-translation_cache = {}
+# Translation cache to avoid duplicate translations, shared by the worker processes
+translation_cache = TranslationCache()
 
-# Track translation service reliability - add the new services
-service_stats = {
-    "google": {"success": 0, "failure": 0, "last_failure": 0},
-    "googletrans": {"success": 0, "failure": 0, "last_failure": 0},
-    "mymemory": {"success": 0, "failure": 0, "last_failure": 0},
-    # Remove the non-working services
-}
+# Earlier translations reused by segments differing only in numbers and whitespace
+translation_memory = TranslationMemory() if TM_PATH else None
 
-# Get email from environment variable or use default
-MYMEMORY_EMAIL = os.getenv("MYMEMORY_EMAIL", "your.email@example.com")
+# Translations in flight, shared by every page and thread of the worker process
+in_flight = SingleFlight()
+# Longest wait on an identical request before sending the segment again
+COALESCE_TIMEOUT = float(os.getenv("COALESCE_TIMEOUT", 120))
 
-# Async sleep function with exponential backoff
-async def backoff_sleep(attempt, base=1.0, max_delay=30.0):
-    delay = min(base * (2 ** attempt), max_delay)
-    await asyncio.sleep(delay)
+# Rate limits, circuit breakers and reliability counters of each service
+backend_health = HealthRegistry()
+
+# Per-process ratios do not add up across processes, the hit ratio is computed from these counters
+CACHE_LOOKUPS = registry.counter("translation_cache_lookups_total", "Translation cache lookups", ["result"])
+COALESCED = registry.counter("translation_coalesced_total", "Segments that waited on an identical in-flight request")
+HEDGED = registry.counter("translation_hedged_requests_total", "Requests hedged after the service was slower than usual", ["backend"])
+HEDGE_WINS = registry.counter("translation_hedge_wins_total", "Hedged requests answered before the original", ["backend"])
+CIRCUIT_OPEN = registry.gauge(
+    "translation_backend_circuit_open", "1 while a backend circuit is not closed in any process", ["backend"], aggregate="max",
+)
+
+def collect_metrics():
+    """Copy cache, coalescing and circuit state into the metrics registry"""
+    CACHE_LOOKUPS.set(translation_cache.stats["hits"], result="hit")
+    CACHE_LOOKUPS.set(translation_cache.stats["misses"], result="miss")
+    COALESCED.set(in_flight.stats["coalesced"])
+    for name, stats in backend_health.snapshot().items():
+        CIRCUIT_OPEN.set(0 if stats["state"] == "closed" else 1, backend=name)
+
+registry.register_collector(collect_metrics)
+
+# Number of html lines translated together as one batch
+PAGE_WINDOW = int(os.getenv("PAGE_WINDOW", 8))
+
+# Number of page windows of a document in flight at once
+WINDOW_CONCURRENCY = int(os.getenv("WINDOW_CONCURRENCY", 4))
+
+# A request slower than this percentile of its service's latency is also sent to the next service
+HEDGING = os.getenv("HEDGING", "1") != "0"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 0.9))
+# Hedged requests of a document are capped to this share of its requests, plus a burst
+HEDGE_RATIO = float(os.getenv("HEDGE_RATIO", 0.1))
+HEDGE_BURST = int(os.getenv("HEDGE_BURST", 10))
+
+# A segment waits out rate limits and open circuits and tries the services again, backing off
+# between rounds, for up to this many seconds before it is left untranslated
+TRANSLATE_DEADLINE = float(os.getenv("TRANSLATE_DEADLINE", 300))
+# Longest single wait, so a segment notices a service coming back early
+SERVICE_WAIT_CAP = float(os.getenv("SERVICE_WAIT_CAP", 30))
+
+# Hedge budget of the document being translated, set for each of its windows
+hedge_budget = contextvars.ContextVar("hedge_budget", default=None)
+# Segments every service failed on, {to_language: set of source texts}, of the document being translated
+fallbacks = contextvars.ContextVar("fallbacks", default=None)
+
+# Semaphores belong to the event loop that created them
+_loop_semaphores = weakref.WeakKeyDictionary()
+
+def service_semaphore(service_name):
+    """Semaphore capping in-flight requests to a service on the running loop"""
+    loop = asyncio.get_running_loop()
+    semaphores = _loop_semaphores.setdefault(loop, {})
+    if service_name not in semaphores:
+        semaphores[service_name] = asyncio.Semaphore(methods[service_name].concurrency)
+    return semaphores[service_name]
+
+# Translation backends by name, see backends.py for adding one
+methods = load_backends()
+
+def acquire_service(candidates, costs):
+    """(service, 0) for the best service with a token available now, otherwise (None, seconds until
+    the earliest token or half-open circuit), (None, None) without candidates"""
+    wait = None
+    for name in backend_health.ranked(candidates, costs):
+        health = backend_health[name]
+        delay = health.try_acquire()
+        if delay == 0:
+            return name, 0
+        if delay is None:
+            # Circuit open, or half-open with a probe already out
+            delay = health.breaker.retry_in()
+        wait = delay if wait is None else min(wait, delay)
+    return None, wait
+
+async def call_service(service_name, text, from_language, to_language):
+    """One request to a service with its health and metrics recorded, returns the translation or None"""
+    health = backend_health[service_name]
+    try:
+        async with service_semaphore(service_name):
+            BACKEND_IN_FLIGHT.inc(backend=service_name)
+            start = time.perf_counter()
+            try:
+                result_text = await methods[service_name](text, from_language, to_language)
+            except RateLimited:
+                BACKEND_SECONDS.observe(time.perf_counter() - start, backend=service_name)
+                raise
+            finally:
+                BACKEND_IN_FLIGHT.dec(backend=service_name)
+            elapsed = time.perf_counter() - start
+            BACKEND_SECONDS.observe(elapsed, backend=service_name)
+    except asyncio.CancelledError:
+        # Lost a hedge race, which says nothing about the service
+        health.breaker.release_probe()
+        BACKEND_REQUESTS.inc(backend=service_name, outcome="cancelled")
+        raise
+    except RateLimited:
+        health.record_throttled()
+        BACKEND_REQUESTS.inc(backend=service_name, outcome="throttled")
+        return None
+    except Exception as e:
+        # A plugin backend that raises counts as a failure, which also gives back a half-open probe
+        logger.warning(f"{service_name} raised {type(e).__name__}: {str(e)[:100]}")
+        health.record_failure()
+        BACKEND_REQUESTS.inc(backend=service_name, outcome="failure")
+        return None
+
+    if result_text:
+        health.record_success()
+        health.record_latency(elapsed)
+        BACKEND_REQUESTS.inc(backend=service_name, outcome="success")
+        return result_text
+    health.record_failure()
+    BACKEND_REQUESTS.inc(backend=service_name, outcome="failure")
+    return None
+
+def record_fallback(text, to_language):
+    """Note a segment left untranslated, the document must not be cached or checkpointed as finished"""
+    failed = fallbacks.get()
+    if failed is not None:
+        failed.setdefault(to_language, set()).add(text)
+
+def is_fallback(text, to_language):
+    failed = fallbacks.get()
+    return failed is not None and text in failed.get(to_language, ())
+
+async def sleep_until(seconds, deadline):
+    """Sleep up to seconds without passing the deadline, False once it has passed"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return False
+    await asyncio.sleep(min(seconds, SERVICE_WAIT_CAP, remaining))
+    return True
+
+def hedge_delay(service_name):
+    """Seconds to wait on a service before asking another one too, None to never hedge"""
+    if not HEDGING or hedge_budget.get() is None:
+        return None
+    return backend_health[service_name].latency_percentile(HEDGE_PERCENTILE)
+
+async def translate_with_services(text, from_language, to_language):
+    """Send text to the best available service, returns (service, translation)
+
+    A request still unanswered after the service's usual (p90) latency is sent
+    to the next best service as well, within the document's hedge budget. The
+    first answer wins and the other request is cancelled.
+
+    Throttled or failing services are waited for and tried again, (None, None)
+    only comes back once TRANSLATE_DEADLINE has passed.
+    """
+    # Skip services that cannot take a payload this large or this language pair
+    size = len(text.encode("utf-8"))
+    eligible = [
+        name for name, backend in methods.items()
+        if size <= backend.max_chars and backend.supports(from_language, to_language)
+    ]
+    candidates = list(eligible)
+    costs = {name: methods[name].cost for name in eligible}
+    budget = hedge_budget.get()
+    running = {}
+    hedged = False
+    deadline = time.monotonic() + TRANSLATE_DEADLINE
+    rounds = 0
+
+    try:
+        while eligible:
+            if not running:
+                if not candidates:
+                    # Every service failed this segment once, back off and try them all again
+                    rounds += 1
+                    candidates = list(eligible)
+                    if not await sleep_until(2 ** (rounds - 1), deadline):
+                        break
+                    continue
+                # Take the best service with a token available, otherwise wait for the earliest
+                # token or for the first open circuit to let a probe through
+                service_name, wait = acquire_service(candidates, costs)
+                if service_name is None:
+                    if not await sleep_until(wait, deadline):
+                        break
+                    continue
+                candidates.remove(service_name)
+                running[asyncio.ensure_future(call_service(service_name, text, from_language, to_language))] = service_name
+                if budget:
+                    budget.record_request()
+
+            # A segment is hedged once, and only towards a service free right now
+            delay = hedge_delay(service_name) if not hedged and candidates else None
+            done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                if budget.try_acquire():
+                    hedge_name, _ = acquire_service(candidates, costs)
+                    if hedge_name is None:
+                        budget.release()
+                    else:
+                        candidates.remove(hedge_name)
+                        running[asyncio.ensure_future(call_service(hedge_name, text, from_language, to_language))] = hedge_name
+                        HEDGED.inc(backend=service_name)
+                        logger.debug(f"{service_name} slower than {delay:.2f}s, hedging with {hedge_name}")
+                # Whether hedged or not, wait for an answer now
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                name = running.pop(task)
+                result_text = task.result()
+                if result_text:
+                    if hedged and name != service_name:
+                        HEDGE_WINS.inc(backend=name)
+                    return name, result_text
+    finally:
+        for task in running:
+            task.cancel()
+    return None, None
 
 # Improved translation function with caching and better error handling
 async def translate_text(text, from_language="en", to_language="ta"):
     """Translate text with caching for better performance"""
     if not text or text.isspace():
         return text
-    
-    # Check cache first
-    cache_key = f"{text}|{from_language}|{to_language}"
-    if cache_key in translation_cache:
-        return translation_cache[cache_key]
-    
-    result = text
-    
-    # Define translation methods
-    async def google_translator(text, from_language, to_language):
-        try:
-            translator = GoogleTranslator(source=from_language, target=to_language)
-            result = translator.translate(text)
-            service_stats["google"]["success"] += 1
-            return result
-        except Exception as e:
-            service_stats["google"]["failure"] += 1
-            service_stats["google"]["last_failure"] = time.time()
-            logger.warning(f"Google Translator failed: {str(e)[:100]}...")
-            return None
-
-    async def googletrans_translator(text, from_language, to_language):
-        try:
-            translator = Translator()
-            result = translator.translate(text, src=from_language, dest=to_language).text
-            service_stats["googletrans"]["success"] += 1
-            return result
-        except Exception as e:
-            service_stats["googletrans"]["failure"] += 1
-            service_stats["googletrans"]["last_failure"] = time.time()
-            logger.warning(f"Googletrans failed: {str(e)[:100]}...")
-            return None
-
-    async def mymemory_translator(text, from_language, to_language):
-        if from_language == "auto":
-            return None
-        try:
-            # Use email from environment variable for higher quota
-            url = f"https://api.mymemory.translated.net/get?q={text}&langpair={from_language}|{to_language}&de={MYMEMORY_EMAIL}"
-            
-            # Add user-agent header to prevent blocking
-            headers = {
-                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36"
-            }
-            
-            response = requests.get(url, headers=headers, timeout=10)
-            
-            if response.status_code != 200:
-                logger.warning(f"MyMemory API returned status code {response.status_code}")
-                service_stats["mymemory"]["failure"] += 1
-                service_stats["mymemory"]["last_failure"] = time.time()
-                return None
-                
-            data = response.json()
-            
-            # Check for rate limiting
-            if "responseStatus" in data and data["responseStatus"] == 429:
-                logger.warning("MyMemory API rate limit reached. Backing off.")
-                service_stats["mymemory"]["failure"] += 1
-                service_stats["mymemory"]["last_failure"] = time.time()
-                return None
-            
-            if data and "responseData" in data and "translatedText" in data["responseData"]:
-                result = data["responseData"]["translatedText"]
-                
-                # Check quota
-                if "responseDetails" in data and "Daily request limit" in str(data["responseDetails"]):
-                    logger.warning(f"MyMemory API quota warning: {data['responseDetails']}")
-                
-                service_stats["mymemory"]["success"] += 1
-                return result
-            else:
-                logger.warning("MyMemory API returned invalid response structure")
-                service_stats["mymemory"]["failure"] += 1
-                service_stats["mymemory"]["last_failure"] = time.time()
-                return None
-                
-        except requests.exceptions.Timeout:
-            logger.warning("MyMemory API request timed out")
-            service_stats["mymemory"]["failure"] += 1
-            service_stats["mymemory"]["last_failure"] = time.time()
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"MyMemory API request failed: {str(e)[:100]}...")
-            service_stats["mymemory"]["failure"] += 1
-            service_stats["mymemory"]["last_failure"] = time.time()
-            return None
-        except Exception as e:
-            logger.warning(f"MyMemory translation API failed: {str(e)[:100]}...")
-            service_stats["mymemory"]["failure"] += 1
-            service_stats["mymemory"]["last_failure"] = time.time()
-            return None
-
-
-    # Smart service selection strategy
-    # Calculate success rates
-    service_priority = []
-    for service, stats in service_stats.items():
-        total = stats["success"] + stats["failure"]
-        # Avoid division by zero
-        if total == 0:
-            success_rate = 0.5  # Default to 50% for new services
-        else:
-            success_rate = stats["success"] / total
-            
-        # Apply cooling off period for recently failed services
-        cooling_factor = 1.0
-        if time.time() - stats["last_failure"] < 5:  # 5 seconds cooling
-            cooling_factor = 0.5
-            
-        # Add some randomness (10%)
-        randomness = 0.9 + (random.random() * 0.2)  # 0.9 to 1.1
-        
-        # Final score
-        score = success_rate * cooling_factor * randomness
-        
-        service_priority.append((service, score))
-    
-    # Sort by score (highest first)
-    service_priority.sort(key=lambda x: x[1], reverse=True)
-    
-    # Try services in priority order
-    methods = {
-        "google": google_translator,
-        "googletrans": googletrans_translator, 
-        "mymemory": mymemory_translator,
-    }
-    
-    # Try each method according to priority
-    for service_name, _ in service_priority:
-        method = methods[service_name]
-
-        # Try up to 3 times per method
-        for attempt in range(3):
-            result_text = await method(text, from_language, to_language)
-            
-            if result_text:
-                # Cache and return successful translation
-                translation_cache[cache_key] = result_text
-                return result_text
-                
-            # Add delay before retry
-            if attempt < 1:  # Only delay before the second attempt
-                await backoff_sleep(attempt)
-    
+    result_text, = await translate_batch([text], from_language, to_language)
+    return result_text
+
+async def translate_single(text, from_language, to_language):
+    """Send one segment to the services, bypassing cache lookup and coalescing"""
+    service_name, result_text = await translate_with_services(text, from_language, to_language)
+    if result_text:
+        # Cache and return successful translation, off the loop as SQLite may wait on a lock or prune
+        await asyncio.to_thread(translation_cache.set, text, from_language, to_language, service_name, result_text)
+        return result_text
+
     # If all methods fail, return original text
     logger.warning("All translation methods failed, returning original text")
+    record_fallback(text, to_language)
     return text
 
-async def process_multiclass(multidiv, from_lang, to_lang):
-    """Process and translate content of a div element"""
-    if not multidiv or not multidiv.text.strip():
-        return
-        
-    if multidiv.find('span'):
-        spans = multidiv.find_all('span')
-        for span in spans:
-            if span.get('class') and len(span.get('class')) >= 4:
-                saved_span = bs4.new_tag(name='span')
-                saved_span['class'] = span.get('class')
-                saved_span.string = " "
-                original_text = multidiv.get_text()
-                translated = await translate_text(original_text, from_lang, to_lang)
-                multidiv.string = translated
-                multidiv.append(saved_span)
-                return
-                
-        original_text = multidiv.get_text()
-        translated = await translate_text(original_text, from_lang, to_lang)
-        multidiv.string = translated
-    else:
-        original_text = multidiv.get_text()
-        translated = await translate_text(original_text, from_lang, to_lang)
-        multidiv.string = translated
+def max_payload(from_language, to_language):
+    """Largest request any backend of the language pair takes"""
+    sizes = [backend.max_chars for backend in methods.values() if backend.supports(from_language, to_language)]
+    return max(sizes, default=0)
+
+def pack_segments(segments, max_chars=None):
+    """Group segments into chunks whose joined size fits in one request"""
+    if max_chars is None:
+        max_chars = max(backend.max_chars for backend in methods.values())
+    chunks = []
+    chunk = []
+    size = 0
+    for segment in segments:
+        segment_size = len(segment.encode("utf-8")) + len(BATCH_SEPARATOR)
+        if chunk and size + segment_size > max_chars:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        chunk.append(segment)
+        size += segment_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+async def translate_chunk(chunk, from_language, to_language):
+    """Translate a chunk of segments in one request, splitting it on mismatch"""
+    if len(chunk) == 1:
+        return [await translate_single(chunk[0], from_language, to_language)]
+
+    service_name, joined = await translate_with_services(BATCH_SEPARATOR.join(chunk), from_language, to_language)
+    if joined:
+        parts = joined.split(BATCH_SEPARATOR)
+        if len(parts) == len(chunk):
+            results = [part.strip() or original for part, original in zip(parts, chunk)]
+            for part, original in zip(parts, chunk):
+                if not part.strip():
+                    record_fallback(original, to_language)
+            await asyncio.to_thread(
+                translation_cache.set_many,
+                {text: result_text for text, result_text in zip(chunk, results) if result_text != text},
+                from_language, to_language, service_name,
+            )
+            return results
+        logger.warning(f"Batch of {len(chunk)} segments came back as {len(parts)}, splitting")
+
+    # Separator was lost or the payload was rejected, halve the chunk and retry
+    middle = len(chunk) // 2
+    first, second = await asyncio.gather(
+        translate_chunk(chunk[:middle], from_language, to_language),
+        translate_chunk(chunk[middle:], from_language, to_language),
+    )
+    return first + second
+
+async def translate_batch(segments, from_language="en", to_language="ta"):
+    """Translate a list of segments with as few backend requests as possible"""
+    results = list(segments)
+    texts = {text for text in segments if text and not text.isspace()}
+    # Numbers, labels, URLs, code and text already in the target language are kept as they are
+    texts -= passthrough(texts, from_language, to_language)
+    # The SQLite tier can wait on another process's lock, which must not stall the other windows
+    cached = await asyncio.to_thread(translation_cache.get_many, list(texts), from_language, to_language, methods) if texts else {}
+    if translation_memory:
+        # MinHash lookups and SQLite reads run in a thread too
+        cached.update(await asyncio.to_thread(translation_memory.lookup, texts - cached.keys(), from_language, to_language))
+    pending = {}
+    for index, text in enumerate(segments):
+        if text not in texts:
+            continue
+        if text in cached:
+            results[index] = cached[text]
+        else:
+            pending.setdefault(text, []).append(index)
+
+    if not pending:
+        return results
+
+    # Segments another page or thread is already fetching are awaited, not sent again
+    owned, waiting = in_flight.claim([(text, from_language, to_language) for text in pending], asyncio.get_running_loop())
+    try:
+        owned_texts = [text for text, _, _ in owned]
+        # Segments containing the separator cannot be split back reliably
+        joinable = [text for text in owned_texts if BATCH_SEPARATOR not in text]
+        single = [text for text in owned_texts if BATCH_SEPARATOR in text]
+        chunks = pack_segments(joinable, max_payload(from_language, to_language)) + [[text] for text in single]
+
+        translated_chunks = await asyncio.gather(
+            *(translate_chunk(chunk, from_language, to_language) for chunk in chunks)
+        )
+        for chunk, translated in zip(chunks, translated_chunks):
+            for text, result_text in zip(chunk, translated):
+                # Waiters fetch an untranslated segment themselves instead of taking the source text
+                in_flight.resolve((text, from_language, to_language), None if is_fallback(text, to_language) else result_text)
+                for index in pending[text]:
+                    results[index] = result_text
+        if translation_memory:
+            await asyncio.to_thread(
+                translation_memory.add_many,
+                {text: results[pending[text][0]] for text in owned_texts if results[pending[text][0]] != text},
+                from_language, to_language,
+            )
+    finally:
+        in_flight.release(owned)
+
+    for (text, _, _), future in waiting.items():
+        try:
+            # Shielded, giving up must not cancel the call for the other waiters
+            result_text = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), COALESCE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Gave up waiting {COALESCE_TIMEOUT:.0f}s on an identical request, sending it again")
+            result_text = None
+        if result_text is None:
+            # The leader gave up, fetch it ourselves
+            result_text = await translate_single(text, from_language, to_language)
+        for index in pending[text]:
+            results[index] = result_text
+
+    if owned:
+        logger.info(f"Translated {len(owned)} unique segments in {len(chunks)} batches")
+    return results
+
+async def process_pages(lines, from_lang, to_lang, checkpoint=None):
+    """Translate a window of html lines together, non page lines pass through"""
+    checkpoints = {to_lang: checkpoint} if checkpoint else None
+    results = await process_pages_multi(lines, from_lang, [to_lang], checkpoints)
+    return results[to_lang]
+
+async def process_pages_multi(lines, from_lang, to_langs, checkpoints=None):
+    """Translate a window of html lines into every target language, parsing each page once"""
+    checkpoints = checkpoints or {}
+    # Pages finished by an earlier run of the same document are taken as they are
+    done = {}
+    for to_lang in to_langs:
+        checkpoint = checkpoints.get(to_lang)
+        done[to_lang] = await checkpoint.load_many(lines) if checkpoint else {}
+    with span("parse", record_span=False):
+        pages = [
+            None if all(index in done[to_lang] for to_lang in to_langs) else parse_page(line)
+            for index, line in enumerate(lines)
+        ]
+
+    async def translate_into(to_lang):
+        finished_before = done[to_lang]
+        # Collect all subdiv texts that need translation
+        texts = [
+            text for index, page in enumerate(pages)
+            if page and index not in finished_before for text in page.texts
+        ]
+
+        # Translate every segment of the window in as few requests as possible
+        translations = await translate_batch(texts, from_lang, to_lang) if texts else []
+
+        results = []
+        finished = []
+        position = 0
+        with span("parse", record_span=False):
+            for index, (line, page) in enumerate(zip(lines, pages)):
+                if page is None or index in finished_before:
+                    results.append(finished_before.get(index, line))
+                    continue
+                count = len(page.texts)
+                results.append(page.render(translations[position:position + count]))
+                # A page with untranslated segments is translated again by the next attempt
+                if not any(is_fallback(text, to_lang) for text in page.texts):
+                    finished.append((line, results[-1]))
+                position += count
+        checkpoint = checkpoints.get(to_lang)
+        if checkpoint:
+            await checkpoint.save_many(finished)
+        return results
+
+    # Every language's batches go out at the same time
+    translated = await asyncio.gather(*(translate_into(to_lang) for to_lang in to_langs))
+    return dict(zip(to_langs, translated))
 
 async def process_page(line, from_lang, to_lang):
     """Process a single page of HTML content"""
     if line[:11] != "<div id=\"pf":
         return None
-        
-    soup = bs4(line, 'html.parser')
-    page = soup.find('div')
-    
-    if not page:
-        return None
-    
-    # Collect all subdiv elements that need translation
-    translation_tasks = []
-    
-    for list_of_div in page.find_all('div', recursive=False):
-        if not list_of_div.text.strip():
-            continue
-            
-        if list_of_div.get('class') and len(list_of_div.get('class')) > 5:
-            # Handle directly
-            translation_tasks.append(process_multiclass(list_of_div, from_lang, to_lang))
-        else:
-            # Handle subdiv elements
-            for subdiv in list_of_div.find_all('div', recursive=False):
-                if subdiv.text.strip():
-                    translation_tasks.append(process_multiclass(subdiv, from_lang, to_lang))
-    
-    # Execute all translation tasks concurrently
-    if translation_tasks:
-        await asyncio.gather(*translation_tasks)
-        
-    return str(soup)
+    result, = await process_pages([line], from_lang, to_lang)
+    return result
 
 async def main(line, from_lang = "en", to_lang = "ta"):
     """Main async function to orchestrate the process"""
@@ -259,16 +462,71 @@ async def main(line, from_lang = "en", to_lang = "ta"):
     if result:
         return result
     else:
-        return line 
+        return line
+
+async def as_async_iterator(lines):
+    """Accept plain iterables as well as async ones"""
+    if hasattr(lines, "__aiter__"):
+        async for line in lines:
+            yield line
+    else:
+        for line in lines:
+            yield line
+
+async def translate_windows(lines, process, window=PAGE_WINDOW, concurrency=WINDOW_CONCURRENCY, failed=None):
+    """Run process(batch) over windows of html lines on the running loop, yielding results in document order
+
+    Segments left untranslated are added to failed, {to_language: set of source texts}.
+    """
+    budget = HedgeBudget(HEDGE_RATIO, HEDGE_BURST)
+    failed = {} if failed is None else failed
+
+    async def run(batch):
+        # Set inside the window's task, so every request of the document shares one budget
+        hedge_budget.set(budget)
+        fallbacks.set(failed)
+        return await process(batch)
+
+    pending = collections.deque()
+    batch = []
+    try:
+        async for line in as_async_iterator(lines):
+            batch.append(line)
+            if len(batch) < window:
+                continue
+            pending.append(asyncio.ensure_future(run(batch)))
+            batch = []
+            if len(pending) >= concurrency:
+                yield await pending.popleft()
+        if batch:
+            pending.append(asyncio.ensure_future(run(batch)))
+        while pending:
+            yield await pending.popleft()
+    finally:
+        # Failed input, a failed window or a consumer that stopped early leaves no window running
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+async def translate_document_multi(lines, from_lang, to_langs, window=PAGE_WINDOW, concurrency=WINDOW_CONCURRENCY, checkpoints=None, failed=None):
+    """Translate html lines into several languages on the running loop, yielding {to_lang: window results} in document order"""
+    process = lambda batch: process_pages_multi(batch, from_lang, to_langs, checkpoints)
+    windows = translate_windows(lines, process, window, concurrency, failed)
+    try:
+        async for results in windows:
+            yield results
+    finally:
+        await windows.aclose()
+
 
 
-    
 if __name__ == "__main__":
     # To run all tests, uncomment the following line:
     # asyncio.run(run_all_tests())
-    
+
     # To test an individual service, uncomment and modify the following line:
     # asyncio.run(test_individual_service("google"))
-    
+
     # To run the main translation function:
     asyncio.run(main())
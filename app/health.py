@@ -0,0 +1,251 @@
+import collections
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Default requests per second and burst size of each service
+DEFAULT_RATE_LIMITS = {
+    "google": (5.0, 10),
+    "googletrans": (3.0, 6),
+    "mymemory": (2.0, 4),
+}
+
+def rate_limit_from_env(service_name):
+    """Read RATE_LIMIT_<SERVICE>="rate/burst", e.g. RATE_LIMIT_GOOGLE=5/10, and return this process's share
+
+    The limit is for the whole host. Buckets live in each process, so the rate
+    and burst are split evenly over the WORKER_PROCESSES worker processes,
+    which web_worker.py sets to the total of its Celery pools at their largest.
+    """
+    rate, burst = DEFAULT_RATE_LIMITS.get(service_name, (5.0, 10))
+    value = os.getenv(f"RATE_LIMIT_{service_name.upper()}")
+    if value:
+        try:
+            rate_text, _, burst_text = value.partition("/")
+            rate = float(rate_text)
+            burst = int(burst_text) if burst_text else max(1, int(rate))
+        except ValueError:
+            logger.warning(f"Ignoring invalid RATE_LIMIT_{service_name.upper()}={value!r}")
+    processes = max(1, int(os.getenv("WORKER_PROCESSES", 1)))
+    return rate / processes, max(1, round(burst / processes))
+
+# Recent response times kept per service, and how many are needed before percentiles are trusted
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", 200))
+LATENCY_MIN_SAMPLES = int(os.getenv("LATENCY_MIN_SAMPLES", 20))
+
+class RateLimited(Exception):
+    """Raised by a backend when the service reports throttling"""
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token, returns 0 on success or the seconds until one is available"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def drain(self):
+        """Empty the bucket after the service told us to slow down"""
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = time.monotonic()
+
+class CircuitBreaker:
+    """Stops routing to a service after repeated failures, probing it again later"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_for = reset_timeout
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may be sent now, half-open lets a single probe through"""
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_for:
+                    return False
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.trip(self.reset_timeout)
+
+    def record_throttled(self, cooldown):
+        with self.lock:
+            self.trip(cooldown)
+
+    def trip(self, duration):
+        # Caller holds the lock
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.open_for = duration
+        self.probing = False
+
+    def release_probe(self):
+        """Give back a half-open probe that was never sent"""
+        with self.lock:
+            self.probing = False
+
+    def retry_in(self, probe_wait=1.0):
+        """Seconds until a request may be tried again, probe_wait while another request probes"""
+        with self.lock:
+            if self.state == OPEN:
+                return max(0.0, self.open_for - (time.monotonic() - self.opened_at))
+            return probe_wait if self.state == HALF_OPEN and self.probing else 0.0
+
+class HedgeBudget:
+    """Hedged requests allowed to a document, a share of its requests plus a small burst"""
+
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self.requests = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def try_acquire(self):
+        with self.lock:
+            if self.hedges >= self.burst + self.ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def release(self):
+        """Give back a hedge that was never sent"""
+        with self.lock:
+            self.hedges -= 1
+
+class BackendHealth:
+    """Rate limit, circuit breaker and counters of one translation service"""
+
+    def __init__(self, name, rate, burst, failure_threshold=5, reset_timeout=30.0, throttle_cooldown=60.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.throttle_cooldown = throttle_cooldown
+        self.stats = {"success": 0, "failure": 0, "throttled": 0, "last_failure": 0}
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Returns 0 if a request may go out now, the seconds to wait for a token, or None if open"""
+        if not self.breaker.allow():
+            return None
+        wait = self.bucket.try_acquire()
+        if wait:
+            self.breaker.release_probe()
+        return wait
+
+    def record_success(self):
+        self.breaker.record_success()
+        with self.lock:
+            self.stats["success"] += 1
+
+    def record_failure(self):
+        self.breaker.record_failure()
+        with self.lock:
+            self.stats["failure"] += 1
+            self.stats["last_failure"] = time.time()
+
+    def record_throttled(self):
+        logger.warning(f"{self.name} is throttling requests, pausing it for {self.throttle_cooldown:.0f}s")
+        self.bucket.drain()
+        self.breaker.record_throttled(self.throttle_cooldown)
+        with self.lock:
+            self.stats["failure"] += 1
+            self.stats["throttled"] += 1
+            self.stats["last_failure"] = time.time()
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def latency_percentile(self, quantile):
+        """Response time below which `quantile` of recent answers came, None until enough were seen"""
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def success_rate(self):
+        total = self.stats["success"] + self.stats["failure"]
+        # Default to 50% for new services
+        return self.stats["success"] / total if total else 0.5
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, state=self.breaker.state)
+
+class HealthRegistry:
+    """Health of every translation service, shared by all pages of a worker process"""
+
+    def __init__(self):
+        self.backends = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.backends:
+                rate, burst = rate_limit_from_env(name)
+                self.backends[name] = BackendHealth(name, rate, burst)
+            return self.backends[name]
+
+    def ranked(self, names, costs=None):
+        """Services ordered best first, closed circuits ahead of the others, cheaper ones ahead of equals"""
+        costs = costs or {}
+        def score(name):
+            health = self[name]
+            closed = health.breaker.state == CLOSED
+            # Add some randomness (10%) to spread load across similar services
+            return (closed, health.success_rate() * (0.9 + random.random() * 0.2) / costs.get(name, 1.0))
+        return sorted(names, key=score, reverse=True)
+
+    def snapshot(self):
+        with self.lock:
+            backends = list(self.backends.values())
+        return {health.name: health.snapshot() for health in backends}
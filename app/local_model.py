@@ -0,0 +1,90 @@
+import importlib
+import os
+import re
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Model of the local backend as module:Class, built once in every worker process
+LOCAL_MODEL = os.getenv("LOCAL_MODEL", "local_model:TinyModel")
+
+_model = None
+
+def load_class(path):
+    """Object named by a module:attribute path"""
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+def load_model(path=LOCAL_MODEL):
+    """Process pool initializer, loads the model of this worker process"""
+    global _model
+    _model = load_class(path)()
+
+def translate_batch(texts, from_language, to_language):
+    """Run in a worker process, translates a list of segments in one inference call"""
+    if _model is None:
+        load_model()
+    return _model.translate_batch(texts, from_language, to_language)
+
+class TinyModel:
+    """Deterministic word-for-word model over a small glossary, for tests and benchmarks"""
+
+    GLOSSARY = {
+        ("en", "fr"): {
+            "the": "le", "and": "et", "page": "page", "table": "tableau", "figure": "figure",
+            "manual": "manuel", "section": "section", "power": "puissance", "input": "entrée",
+            "output": "sortie", "warning": "avertissement", "note": "remarque", "see": "voir",
+        },
+        ("en", "de"): {
+            "the": "die", "and": "und", "page": "Seite", "table": "Tabelle", "figure": "Abbildung",
+            "manual": "Handbuch", "section": "Abschnitt", "power": "Leistung", "input": "Eingang",
+            "output": "Ausgang", "warning": "Warnung", "note": "Hinweis", "see": "siehe",
+        },
+        ("en", "es"): {
+            "the": "el", "and": "y", "page": "página", "table": "tabla", "figure": "figura",
+            "manual": "manual", "section": "sección", "power": "potencia", "input": "entrada",
+            "output": "salida", "warning": "advertencia", "note": "nota", "see": "ver",
+        },
+    }
+    language_pairs = set(GLOSSARY)
+    WORD = re.compile(r"\w+")
+
+    def translate_batch(self, texts, from_language, to_language):
+        glossary = self.GLOSSARY.get((from_language, to_language), {})
+
+        def replace(match):
+            word = match.group(0)
+            translated = glossary.get(word.lower(), word)
+            return translated.capitalize() if word[0].isupper() else translated
+
+        return [self.WORD.sub(replace, text) for text in texts]
+
+class MarianModel:
+    """Helsinki-NLP opus-mt models through transformers, one model per language pair"""
+
+    # Any pair with a published opus-mt model
+    language_pairs = None
+
+    def __init__(self):
+        try:
+            from transformers import MarianMTModel, MarianTokenizer
+        except ImportError as e:
+            raise RuntimeError("MarianModel needs the transformers and sentencepiece packages") from e
+        self.model_class = MarianMTModel
+        self.tokenizer_class = MarianTokenizer
+        self.name_template = os.getenv("MARIAN_MODEL_NAME", "Helsinki-NLP/opus-mt-{from_language}-{to_language}")
+        self.models = {}
+
+    def load(self, from_language, to_language):
+        key = (from_language, to_language)
+        if key not in self.models:
+            name = self.name_template.format(from_language=from_language, to_language=to_language)
+            self.models[key] = (self.tokenizer_class.from_pretrained(name), self.model_class.from_pretrained(name))
+        return self.models[key]
+
+    def translate_batch(self, texts, from_language, to_language):
+        tokenizer, model = self.load(from_language, to_language)
+        inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True)
+        outputs = model.generate(**inputs)
+        return tokenizer.batch_decode(outputs, skip_special_tokens=True)
@@ -0,0 +1,355 @@
+import contextlib
+import contextvars
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Worker processes write snapshots here, the web process merges them for /metrics
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "pdf_metrics"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+# Counters and histograms of exited processes are folded into this snapshot
+ARCHIVE_NAME = "archive.json"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+class Metric:
+    """A counter, gauge or histogram with optional labels"""
+
+    def __init__(self, registry, name, help_text, kind, labelnames=(), buckets=DEFAULT_BUCKETS, aggregate="sum"):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if kind == "histogram" else ()
+        # How the values of several processes combine, "sum" or "max"
+        self.aggregate = aggregate
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.maybe_flush()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Bucket counts, then sum and count
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+        self.registry.maybe_flush()
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            samples = [[list(key), value[:] if isinstance(value, list) else value] for key, value in self.values.items()]
+        return {
+            "name": self.name, "help": self.help, "kind": self.kind, "aggregate": self.aggregate,
+            "labelnames": list(self.labelnames), "buckets": list(self.buckets), "samples": samples,
+        }
+
+class Registry:
+    """Metrics of one process, periodically written to METRICS_DIR"""
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self.collectors = []
+        self.last_flush = 0.0
+        self.instance = None
+        self.instance_pid = None
+        self.lock = threading.Lock()
+
+    def instance_name(self):
+        """Snapshot name of this process, unique even when a later process gets the same pid"""
+        if self.instance_pid != os.getpid():
+            self.instance = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self.instance_pid = os.getpid()
+        return self.instance
+
+    def metric(self, kind, name, help_text, labelnames=(), **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Metric(self, name, help_text, kind, labelnames, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.metric("counter", name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=(), aggregate="sum"):
+        """Gauge summed across processes, or with aggregate="max" the largest value, for flags and ratios"""
+        return self.metric("gauge", name, help_text, labelnames, aggregate=aggregate)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.metric("histogram", name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, collector):
+        """Callable run before every snapshot, used to copy state kept elsewhere into gauges"""
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {"pid": os.getpid(), "time": time.time(), "metrics": [metric.snapshot() for metric in metrics]}
+
+    def flush(self):
+        """Write this process' snapshot atomically"""
+        if not self.directory:
+            return
+        self.last_flush = time.monotonic()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{self.instance_name()}.json")
+            # The loop and converter threads may flush at the same time
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                json.dump(self.snapshot(), file)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write metrics snapshot: {e}")
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+registry = Registry()
+
+# Per-document stages, observed once per document with the total time spent in each
+STAGE_SECONDS = registry.histogram(
+    "pdf_stage_seconds", "Time spent per document in each pipeline stage", ["stage"],
+)
+DOCUMENTS = registry.counter("pdf_documents_total", "Documents processed", ["status"])
+BACKEND_SECONDS = registry.histogram(
+    "translation_backend_seconds", "Latency of translation backend requests", ["backend"],
+)
+BACKEND_REQUESTS = registry.counter(
+    "translation_backend_requests_total", "Translation backend requests by outcome", ["backend", "outcome"],
+)
+BACKEND_IN_FLIGHT = registry.gauge(
+    "translation_backend_in_flight", "Translation backend requests currently in flight", ["backend"],
+)
+
+# Trace of the document being processed, carried through tasks and producer threads
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+class Trace:
+    """Spans of one task, with stage totals folded into STAGE_SECONDS when it ends"""
+
+    def __init__(self, name, **attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds, record_span=True):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            if record_span:
+                self.spans.append((stage, round(time.perf_counter() - self.start - seconds, 4), round(seconds, 4)))
+
+    def finish(self, status):
+        total = time.perf_counter() - self.start
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        STAGE_SECONDS.observe(total, stage="total")
+        DOCUMENTS.inc(status=status)
+        stages = ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in sorted(self.stages.items()))
+        logger.info(f"trace {self.trace_id} {self.name} {status} in {total:.2f}s ({stages}) spans={len(self.spans)}")
+        logger.debug(f"trace {self.trace_id} {self.attributes} spans (stage, start, seconds): {self.spans}")
+        registry.flush()
+
+@contextlib.contextmanager
+def trace(name, **attributes):
+    """Start a trace for one task, every span below it is attributed to it"""
+    document = Trace(name, **attributes)
+    token = current_trace.set(document)
+    status = "error"
+    try:
+        yield document
+        status = "success"
+    finally:
+        current_trace.reset(token)
+        document.finish(status)
+
+@contextlib.contextmanager
+def span(stage, record_span=True):
+    """Time a block and add it to the current trace's stage totals"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(stage, time.perf_counter() - start, record_span)
+
+def add_stage_time(stage, seconds, record_span=True):
+    document = current_trace.get()
+    if document is not None:
+        document.add(stage, seconds, record_span)
+
+def load_snapshot(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def write_snapshot(path, snapshot):
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(snapshot, file)
+    os.replace(temp_path, path)
+
+def compact(directory=METRICS_DIR):
+    """Fold the snapshots of exited processes into the archive and remove them"""
+    archive_path = os.path.join(directory, ARCHIVE_NAME)
+    with open(os.path.join(directory, "archive.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        names = set(os.listdir(directory))
+        archive = load_snapshot(archive_path) or {"pid": None, "metrics": [], "folded": []}
+        # Names folded before but whose removal failed stay excluded until they are gone
+        folded = {name for name in archive.get("folded", []) if name in names}
+        dead = {}
+        for name in names - folded - {ARCHIVE_NAME}:
+            if not name.endswith(".json"):
+                continue
+            snapshot = load_snapshot(os.path.join(directory, name))
+            if snapshot is not None and not process_alive(snapshot.get("pid")):
+                dead[name] = snapshot
+        if not dead and len(folded) == len(archive.get("folded", [])):
+            return
+        merged = merge([archive] + list(dead.values()))
+        metrics = [
+            dict(metric, samples=[[list(labels), value] for labels, value in metric["samples"].items()])
+            for metric in merged.values()
+        ]
+        write_snapshot(archive_path, {"pid": None, "time": time.time(), "metrics": metrics, "folded": sorted(folded | set(dead))})
+        for name in dead:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                continue
+
+def read_snapshots(directory=METRICS_DIR):
+    snapshots = []
+    if not directory or not os.path.isdir(directory):
+        return snapshots
+    try:
+        compact(directory)
+    except OSError as e:
+        logger.warning(f"Failed to compact metrics snapshots: {e}")
+    names = [name for name in os.listdir(directory) if name.endswith(".json")]
+    archive = load_snapshot(os.path.join(directory, ARCHIVE_NAME)) if ARCHIVE_NAME in names else None
+    folded = set(archive.get("folded", [])) if archive else set()
+    for name in names:
+        if name in folded:
+            continue
+        snapshot = load_snapshot(os.path.join(directory, name))
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    return snapshots
+
+def process_alive(pid):
+    if not pid:
+        # The archive, which holds no gauges
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def merge(snapshots):
+    """Sum samples across processes, or take the largest for aggregate="max" gauges. Gauges only
+    count processes that are still running"""
+    merged = {}
+    for snapshot in snapshots:
+        alive = process_alive(snapshot.get("pid", 0))
+        for metric in snapshot["metrics"]:
+            if metric["kind"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(metric["name"], dict(metric, samples={}))
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = value
+                elif isinstance(value, list):
+                    target["samples"][key] = [a + b for a, b in zip(current, value)]
+                elif metric.get("aggregate") == "max":
+                    target["samples"][key] = max(current, value)
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+def render(merged):
+    """Prometheus text exposition of merged metrics"""
+    lines = []
+    for name, metric in sorted(merged.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labelnames = metric["labelnames"]
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{format_labels(labelnames, labels)} {value}")
+                continue
+            for bound, count in zip(metric["buckets"], value):
+                lines.append(f"{name}_bucket{format_labels(labelnames, labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{format_labels(labelnames, labels, [('le', '+Inf')])} {value[-1]}")
+            lines.append(f"{name}_sum{format_labels(labelnames, labels)} {value[-2]}")
+            lines.append(f"{name}_count{format_labels(labelnames, labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
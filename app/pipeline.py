@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+from dotenv import load_dotenv
+from metrics import span
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Lines buffered between the converter and the translation stage
+CONVERT_QUEUE_SIZE = int(os.getenv("CONVERT_QUEUE_SIZE", 256))
+
+# S3 multipart parts must be at least 5 MiB except for the last one
+UPLOAD_PART_SIZE = max(int(os.getenv("UPLOAD_PART_SIZE", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+UPLOAD_MAX_IN_FLIGHT = int(os.getenv("UPLOAD_MAX_IN_FLIGHT", 2))
+
+_DONE = object()
+
+async def stream_in_thread(iterable, maxsize=CONVERT_QUEUE_SIZE):
+    """Consume a blocking iterable in a thread, handing items over through a bounded queue"""
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    slots = threading.Semaphore(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        # Wait for the consumer to free a slot, give up once it has gone away
+        while not slots.acquire(timeout=0.5):
+            if stop.is_set():
+                return False
+        loop.call_soon_threadsafe(items.put_nowait, item)
+        return True
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if stop.is_set() or not put(item):
+                    break
+            else:
+                put(_DONE)
+        except BaseException as e:
+            put(e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+
+    # The producer keeps the caller's context so its spans land in the same trace
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(produce,), name="stream-producer", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = await items.get()
+            slots.release()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # The producer may still be using files the caller removes next
+        await asyncio.to_thread(thread.join)
+
+class MultipartUploader:
+    """Streams text to an S3 object, uploading parts while later ones are still being produced"""
+
+    def __init__(self, client, bucket, key, part_size=UPLOAD_PART_SIZE, max_in_flight=UPLOAD_MAX_IN_FLIGHT):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.next_part = 1
+        self.pending = set()
+        self.error = None
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.size = 0
+
+    def check(self):
+        """Raise the first failed part upload, the object must not be completed without it"""
+        if self.error is not None:
+            raise self.error
+
+    def part_done(self, task):
+        self.pending.discard(task)
+        if not task.cancelled() and task.exception() is not None and self.error is None:
+            self.error = task.exception()
+
+    async def write(self, text):
+        self.check()
+        data = text.encode("utf-8")
+        self.buffer += data
+        self.size += len(data)
+        if len(self.buffer) >= self.part_size:
+            await self.flush_part()
+
+    async def writelines(self, lines):
+        await self.write("".join(lines))
+
+    async def flush_part(self):
+        if self.upload_id is None:
+            response = await asyncio.to_thread(
+                self.client.create_multipart_upload, Bucket=self.bucket, Key=self.key
+            )
+            self.upload_id = response["UploadId"]
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        part_number = self.next_part
+        self.next_part += 1
+        # Backpressure: wait while too many parts are on the wire
+        await self.slots.acquire()
+        task = asyncio.ensure_future(self.upload_part(part_number, data))
+        self.pending.add(task)
+        task.add_done_callback(self.part_done)
+
+    async def upload_part(self, part_number, data):
+        try:
+            with span("upload"):
+                response = await asyncio.to_thread(
+                    self.client.upload_part,
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=data,
+                )
+            self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        finally:
+            self.slots.release()
+
+    async def complete(self):
+        """Upload what is left and finish the object"""
+        self.check()
+        if self.upload_id is None:
+            # Small outputs never needed a multipart upload
+            with span("upload"):
+                await asyncio.to_thread(
+                    self.client.put_object, Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer)
+                )
+            self.buffer.clear()
+            return
+        if self.buffer:
+            await self.flush_part()
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+        self.check()
+        parts = sorted(self.parts, key=lambda part: part["PartNumber"])
+        if len(parts) != self.next_part - 1:
+            raise RuntimeError(f"Upload of {self.key} has {len(parts)} of {self.next_part - 1} parts")
+        with span("upload"):
+            await asyncio.to_thread(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        logger.info(f"Uploaded {self.size} bytes to {self.bucket}/{self.key} in {len(parts)} parts")
+
+    async def abort(self):
+        for task in list(self.pending):
+            task.cancel()
+        if self.upload_id is None:
+            return
+        try:
+            await asyncio.to_thread(
+                self.client.abort_multipart_upload,
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to abort multipart upload of {self.key}: {e}")
@@ -0,0 +1,118 @@
+import functools
+import os
+import re
+import unicodedata
+from dotenv import load_dotenv
+from metrics import registry
+
+# Load environment variables
+load_dotenv()
+
+# Segments that need no translation are passed through without a backend request, PREFILTER=0 turns it off
+PREFILTER_ENABLED = os.getenv("PREFILTER", "1") != "0"
+
+PREFILTER_SEGMENTS = registry.counter(
+    "translation_prefilter_segments_total", "Unique segments seen by the pre-filter by verdict", ["verdict"],
+)
+
+# Scripts written by languages that do not use the Latin alphabet, the rest default to Latin
+LANGUAGE_SCRIPTS = {
+    "ar": {"ARABIC"}, "fa": {"ARABIC"}, "ur": {"ARABIC"}, "ps": {"ARABIC"},
+    "he": {"HEBREW"}, "iw": {"HEBREW"}, "yi": {"HEBREW"},
+    "ru": {"CYRILLIC"}, "uk": {"CYRILLIC"}, "bg": {"CYRILLIC"}, "mk": {"CYRILLIC"},
+    "be": {"CYRILLIC"}, "kk": {"CYRILLIC"}, "mn": {"CYRILLIC"}, "sr": {"CYRILLIC"},
+    "el": {"GREEK"}, "hy": {"ARMENIAN"}, "ka": {"GEORGIAN"},
+    "hi": {"DEVANAGARI"}, "mr": {"DEVANAGARI"}, "ne": {"DEVANAGARI"},
+    "bn": {"BENGALI"}, "pa": {"GURMUKHI"}, "gu": {"GUJARATI"}, "or": {"ORIYA"},
+    "ta": {"TAMIL"}, "te": {"TELUGU"}, "kn": {"KANNADA"}, "ml": {"MALAYALAM"}, "si": {"SINHALA"},
+    "th": {"THAI"}, "lo": {"LAO"}, "my": {"MYANMAR"}, "km": {"KHMER"},
+    "zh": {"CJK"}, "zh-cn": {"CJK"}, "zh-tw": {"CJK"},
+    "ja": {"CJK", "HIRAGANA", "KATAKANA"}, "ko": {"HANGUL"},
+}
+
+UNIT = r"(?:%|‰|°[CF]?|[kMGTmµunp]?(?:V|A|W|Wh|Hz|Ω|F|H|m|g|s|B|b|bps|Pa|l|L)|mm|cm|km|kg|mg|ms|us|ns|dB|dBm|rpm|x)"
+# A number with an optional unit, sign or comparison: 12, -3.5, 1,024, 10%, 3.3V, 25°C
+NUMBER = re.compile(r"[-+±~≈<>≤≥]?[$€£¥₹]?\d[\d.,:/]*" + UNIT + "?")
+# A unit standing on its own next to a number: 5 kg, 100 Ω
+UNIT_TOKEN = re.compile(UNIT)
+# Enumeration and figure labels: (a), b), (iv), A1, 3.2.1
+LABEL = re.compile(r"\([A-Za-z\d]{1,4}\)|[A-Za-z][).]|[A-Za-z]?\d+(?:\.\d+)*[A-Za-z]?[).:]?")
+URL = re.compile(r"(?:https?://|ftp://|www\.)\S+|[\w.+-]+@[\w-]+(?:\.[\w-]+)+", re.IGNORECASE)
+# Identifiers, calls, paths and hex literals, always a single token
+CODE = re.compile(
+    r"0x[0-9a-fA-F]+"
+    r"|[A-Za-z_]\w*(?:\.\w+)*\([^()\s]*\)"
+    r"|[A-Za-z]\w*_\w+"
+    r"|[a-z]+[A-Z]\w*"
+    r"|(?:\.{0,2}/)?(?:[\w.-]+/)+[\w-]+\.\w+|/[\w.-]+(?:/[\w.-]+)*/?"
+    r"|(?:[A-Za-z]:)?\\?(?:[\w.-]+\\)+[\w.-]+"
+    r"|[A-Za-z_]\w*(?:::\w+|->\w+)+"
+)
+PUNCTUATION = re.compile(r"[^\w\s]+")
+
+@functools.lru_cache(maxsize=4096)
+def char_script(char):
+    """First word of the character's Unicode name, which is its script for letters"""
+    name = unicodedata.name(char, "")
+    if name.startswith("CJK"):
+        return "CJK"
+    return name.split(" ", 1)[0]
+
+def language_scripts(language):
+    if not language or language == "auto":
+        return None
+    language = language.lower()
+    return LANGUAGE_SCRIPTS.get(language) or LANGUAGE_SCRIPTS.get(language.split("-")[0], {"LATIN"})
+
+def in_target_script(letters, from_language, to_language):
+    """Every letter is written in the target's script, which the source language does not use"""
+    source, target = language_scripts(from_language), language_scripts(to_language)
+    if not source or not target or source & target:
+        return False
+    scripts = {char_script(char) for char in letters}
+    return scripts <= target
+
+def classify(text, from_language, to_language):
+    """Why a segment needs no translation, or None when it must be sent to a backend"""
+    stripped = text.strip()
+    if not stripped:
+        return "blank"
+    letters = [char for char in stripped if char.isalpha()]
+    if not letters:
+        return "number" if any(char.isdigit() for char in stripped) else "symbol"
+    tokens = stripped.split()
+    numbers = [bool(NUMBER.fullmatch(token)) for token in tokens]
+    if any(numbers) and all(
+        is_number or PUNCTUATION.fullmatch(token) or UNIT_TOKEN.fullmatch(token)
+        for token, is_number in zip(tokens, numbers)
+    ):
+        return "number"
+    if len(tokens) == 1:
+        token = stripped.rstrip(".,;:")
+        if LABEL.fullmatch(stripped):
+            return "label"
+        if URL.fullmatch(token):
+            return "url"
+        if CODE.fullmatch(token):
+            return "code"
+    elif all(URL.fullmatch(token.rstrip(".,;:")) for token in tokens):
+        return "url"
+    if in_target_script(letters, from_language, to_language):
+        return "target_language"
+    return None
+
+def passthrough(texts, from_language, to_language):
+    """The texts that are kept as they are, counted by verdict"""
+    if not PREFILTER_ENABLED:
+        return set()
+    kept = set()
+    verdicts = {}
+    for text in texts:
+        verdict = classify(text, from_language, to_language)
+        if verdict:
+            kept.add(text)
+        verdict = verdict or "translate"
+        verdicts[verdict] = verdicts.get(verdict, 0) + 1
+    for verdict, count in verdicts.items():
+        PREFILTER_SEGMENTS.inc(count, verdict=verdict)
+    return kept
@@ -0,0 +1,203 @@
+import html
+import logging
+import os
+import re
+from bs4 import BeautifulSoup as bs4
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "fast" rewrites page markup in place, "bs4" parses the whole page with BeautifulSoup
+PAGE_REWRITER = os.getenv("PAGE_REWRITER", "fast")
+
+# Tags and comments of a page line, attribute values of pdf2htmlEX output never contain ">"
+TOKEN = re.compile(r"<!--.*?-->|<(/?)([a-zA-Z][^\s/>]*)([^>]*)>", re.DOTALL)
+CLASS_VALUE = re.compile(r"""\bclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+# Whitespace handling of BeautifulSoup's tree builder
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+
+class RewriteError(Exception):
+    """The page markup is not regular enough for the fast rewriter"""
+
+def segment_span(multidiv):
+    """Return the classes of the span to keep after translating, if any"""
+    if multidiv.find('span'):
+        for span in multidiv.find_all('span'):
+            if span.get('class') and len(span.get('class')) >= 4:
+                return span.get('class')
+    return None
+
+def apply_translation(soup, multidiv, translated, span_classes):
+    """Replace the content of a div with its translation"""
+    multidiv.string = translated
+    if span_classes:
+        saved_span = soup.new_tag(name='span')
+        saved_span['class'] = span_classes
+        saved_span.string = " "
+        multidiv.append(saved_span)
+
+def collect_segments(page):
+    """Find the divs of a page that carry translatable text"""
+    segments = []
+
+    for list_of_div in page.find_all('div', recursive=False):
+        if not list_of_div.text.strip():
+            continue
+
+        if list_of_div.get('class') and len(list_of_div.get('class')) > 5:
+            # Handle directly
+            segments.append(list_of_div)
+        else:
+            # Handle subdiv elements
+            for subdiv in list_of_div.find_all('div', recursive=False):
+                if subdiv.text.strip():
+                    segments.append(subdiv)
+    return segments
+
+class SoupPage:
+    """Page parsed into a BeautifulSoup tree and serialised again"""
+
+    def __init__(self, line):
+        self.soup = bs4(line, 'html.parser')
+        page = self.soup.find('div')
+        if not page:
+            raise RewriteError("page has no div")
+        self.nodes = [(div, segment_span(div)) for div in collect_segments(page)]
+        self.texts = [div.get_text() for div, _ in self.nodes]
+
+    def render(self, translations):
+        for (div, span_classes), translated in zip(self.nodes, translations):
+            apply_translation(self.soup, div, translated, span_classes)
+        return str(self.soup)
+
+class Element:
+    __slots__ = ("tag", "classes", "content_start", "content_end", "children", "text", "span_classes")
+
+    def __init__(self, tag, classes, content_start):
+        self.tag = tag
+        self.classes = classes
+        self.content_start = content_start
+        self.content_end = None
+        self.children = []
+        self.text = []
+        self.span_classes = None
+
+    def get_text(self):
+        return "".join(self.text)
+
+def text_node(text, stack):
+    """Text between two tokens as BeautifulSoup keeps it, whitespace-only runs become one space or newline"""
+    if text.strip(ASCII_SPACES) or any(element.tag in PRESERVE_WHITESPACE_TAGS for element in stack):
+        return text
+    return "\n" if "\n" in text else " "
+
+class FastPage:
+    """Page rewritten in place: only the content of text-bearing divs is replaced, the rest is copied through"""
+
+    def __init__(self, line):
+        self.line = line
+        page = self.parse(line)
+        self.nodes = self.collect(page)
+        self.texts = [div.get_text() for div in self.nodes]
+
+    @staticmethod
+    def parse(line):
+        """Build a skeleton tree of element positions, returns the first element"""
+        root = Element(None, [], 0)
+        stack = [root]
+        position = 0
+        for match in TOKEN.finditer(line):
+            if match.start() > position:
+                text = text_node(html.unescape(line[position:match.start()]), stack)
+                for element in stack:
+                    element.text.append(text)
+            position = match.end()
+
+            closing, tag = match.group(1), match.group(2)
+            if tag is None:
+                # Comment
+                continue
+            tag = tag.lower()
+            if closing:
+                if not any(element.tag == tag for element in stack[1:]):
+                    continue
+                while True:
+                    element = stack.pop()
+                    element.content_end = match.start()
+                    if element.tag == tag:
+                        break
+                    # Implicitly closed element, html.parser would nest the rest differently
+                    raise RewriteError(f"unbalanced </{tag}>")
+                continue
+
+            attributes = match.group(3)
+            class_match = CLASS_VALUE.search(attributes)
+            classes = next(filter(None, class_match.groups()), "").split() if class_match else []
+            element = Element(tag, classes, match.end())
+            stack[-1].children.append(element)
+            if tag == "span" and len(classes) >= 4:
+                for ancestor in stack:
+                    if ancestor.span_classes is None:
+                        ancestor.span_classes = classes
+            if tag in VOID_TAGS or attributes.rstrip().endswith("/"):
+                element.content_end = match.end()
+                continue
+            stack.append(element)
+
+        if position < len(line):
+            text = text_node(html.unescape(line[position:]), stack)
+            for element in stack:
+                element.text.append(text)
+        if len(stack) > 1 or not root.children or root.children[0].tag != "div":
+            raise RewriteError("page div is not closed")
+        return root.children[0]
+
+    @staticmethod
+    def collect(page):
+        """Same selection as collect_segments on the skeleton tree"""
+        segments = []
+        for list_of_div in page.children:
+            if list_of_div.tag != "div" or not list_of_div.get_text().strip():
+                continue
+            if len(list_of_div.classes) > 5:
+                segments.append(list_of_div)
+            else:
+                for subdiv in list_of_div.children:
+                    if subdiv.tag == "div" and subdiv.get_text().strip():
+                        segments.append(subdiv)
+        return segments
+
+    def render(self, translations):
+        parts = []
+        position = 0
+        for div, translated in zip(self.nodes, translations):
+            parts.append(self.line[position:div.content_start])
+            parts.append(html.escape(translated, quote=False))
+            if div.span_classes:
+                parts.append(f'<span class="{" ".join(div.span_classes)}"> </span>')
+            position = div.content_end
+        parts.append(self.line[position:])
+        return "".join(parts)
+
+def parse_page(line):
+    """Parse a page line with the configured engine, returns None for other lines"""
+    if line[:11] != "<div id=\"pf":
+        return None
+
+    if PAGE_REWRITER == "fast":
+        try:
+            return FastPage(line)
+        except RewriteError as e:
+            logger.info(f"Falling back to BeautifulSoup for page: {e}")
+    try:
+        return SoupPage(line)
+    except RewriteError:
+        return None
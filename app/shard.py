@@ -0,0 +1,103 @@
+import logging
+import os
+from dotenv import load_dotenv
+from artifacts import read_lines
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Documents of at least SHARD_MIN_PAGES pages are translated in chunks of SHARD_PAGES pages by
+# several workers, SHARDING=0 keeps every document on the worker that converts it
+SHARDING = os.getenv("SHARDING", "1") != "0"
+SHARD_MIN_PAGES = int(os.getenv("SHARD_MIN_PAGES", 300))
+SHARD_PAGES = int(os.getenv("SHARD_PAGES", 50))
+# Chunks and their translations until the merge, abandoned jobs are left to the bucket's lifecycle rules
+SHARD_BUCKET = os.getenv("SHARD_BUCKET") or os.getenv("OUT_BUCKET")
+SHARD_PREFIX = os.getenv("SHARD_PREFIX", "shards/")
+
+PAGE_CONTAINER = "<div id=\"page-container\">"
+
+def is_page(line):
+    return line.startswith("<div id=\"pf")
+
+class ShardStore:
+    """Converted head and page chunks of one sharded document, and their translations"""
+
+    def __init__(self, client, job_id, bucket=SHARD_BUCKET, prefix=SHARD_PREFIX):
+        self.client = client
+        self.job_id = job_id
+        self.bucket = bucket
+        self.prefix = f"{prefix}{job_id}/"
+
+    def head_key(self):
+        return f"{self.prefix}head.html"
+
+    def source_key(self, index):
+        return f"{self.prefix}source/{index:05d}.html"
+
+    def translated_key(self, index, to_language):
+        return f"{self.prefix}{to_language}/{index:05d}.html"
+
+    def split(self, lines, dest_dir, pages_per_chunk=None):
+        """Upload the head and every chunk of pages_per_chunk pages of html lines, returns the chunk count"""
+        pages_per_chunk = pages_per_chunk or SHARD_PAGES
+        path = os.path.join(dest_dir, "chunk.html")
+        chunks = 0
+        pages = 0
+        in_head = True
+        file = open(path, "w", encoding="utf-8", newline="")
+        try:
+            for line in lines:
+                file.write(line)
+                if in_head:
+                    if line.strip() != PAGE_CONTAINER:
+                        continue
+                    key = self.head_key()
+                    in_head = False
+                elif is_page(line):
+                    pages += 1
+                    if pages < pages_per_chunk:
+                        continue
+                    key = self.source_key(chunks)
+                    chunks += 1
+                    pages = 0
+                else:
+                    continue
+                file.close()
+                self.client.upload_file(path, self.bucket, key)
+                file = open(path, "w", encoding="utf-8", newline="")
+            file.close()
+            # What follows the last page, or the whole document when it has no page container
+            if in_head:
+                self.client.upload_file(path, self.bucket, self.head_key())
+            else:
+                self.client.upload_file(path, self.bucket, self.source_key(chunks))
+                chunks += 1
+        finally:
+            file.close()
+        logger.info(f"Split into {chunks} chunks under {self.bucket}/{self.prefix}")
+        return chunks
+
+    def download(self, key, dest_dir):
+        """Lines of a stored part"""
+        path = os.path.join(dest_dir, key.rsplit("/", 1)[-1])
+        self.client.download_file(self.bucket, key, path)
+        return read_lines(path)
+
+    def upload(self, key, path):
+        self.client.upload_file(path, self.bucket, key)
+
+    def clear(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        keys = [
+            item["Key"]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix)
+            for item in page.get("Contents", [])
+        ]
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys[start:start + 1000]], "Quiet": True},
+            )
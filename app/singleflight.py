@@ -0,0 +1,53 @@
+import concurrent.futures
+import threading
+
+class SingleFlight:
+    """Lets concurrent callers asking for the same key share one pending result
+
+    Futures are thread-safe, so callers on different event loops or threads of a
+    worker process can wait on a call another one is making. A key owned from an
+    event loop that is no longer running, such as the loop of a finished task
+    that left a window behind, is given up to the next caller.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0, "abandoned": 0}
+
+    def claim(self, keys, loop=None):
+        """Split keys into those the caller must fetch and {key: future} already in flight"""
+        owned = []
+        waiting = {}
+        abandoned = []
+        with self.lock:
+            for key in keys:
+                call = self.calls.get(key)
+                if call is not None and call[1] is not None and not call[1].is_running():
+                    abandoned.append(call[0])
+                    call = None
+                if call is None:
+                    self.calls[key] = (concurrent.futures.Future(), loop)
+                    owned.append(key)
+                else:
+                    waiting[key] = call[0]
+            self.stats["leaders"] += len(owned)
+            self.stats["coalesced"] += len(waiting)
+            self.stats["abandoned"] += len(abandoned)
+        # Whoever still waits on an abandoned call fetches it itself
+        for future in abandoned:
+            if not future.done():
+                future.set_result(None)
+        return owned, waiting
+
+    def resolve(self, key, value):
+        """Hand the result of an owned key to everyone waiting for it"""
+        with self.lock:
+            call = self.calls.pop(key, None)
+        if call is not None and not call[0].done():
+            call[0].set_result(value)
+
+    def release(self, keys):
+        """Give up owned keys without a result, waiters get None and fetch it themselves"""
+        for key in keys:
+            self.resolve(key, None)
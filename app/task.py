@@ -1,21 +1,29 @@
-from celery import Celery
+from celery import Celery, chord, group
+from celery.exceptions import Ignore
 import logging
-from functools import partial
 import re
 import os
-import boto3
-import subprocess
 import tempfile
 import ssl
-import concurrent.futures
-from extract import main as extract_main
-# loading environment variables
+import uuid
+import collections
+import contextlib
+# loading environment variables, before the modules below read their settings at import
 from dotenv import load_dotenv
-from db import update
 if os.path.exists('/etc/secrets/ENV_FILE'):
     load_dotenv('/etc/secrets/ENV_FILE')
 else:
     load_dotenv()
+from extract import translate_document_multi, close_http_session
+from pipeline import MultipartUploader, stream_in_thread
+from convert import convert_pdf, count_pages
+from checkpoint import CHECKPOINT_ENABLED, Checkpoint, checkpoint_store
+from artifacts import ARTIFACT_CACHE, ArtifactCache, file_digest
+from assets import EXTERNAL_ASSETS, AssetStore
+from shard import PAGE_CONTAINER, SHARD_MIN_PAGES, SHARDING, ShardStore, is_page
+from metrics import add_stage_time, trace
+from clients import ProcessLocal
+from db import ProgressReporter, set_status
 import time
 
 import asyncio
@@ -39,7 +47,37 @@ app.conf.update(
         'ssl_cert_reqs': ssl.CERT_NONE  # Disable certificate verification
     }
 )
-s3 = boto3.client(
+
+# Documents are routed by size so small ones never wait behind large ones
+PDF_QUEUE_SMALL = os.getenv("PDF_QUEUE_SMALL", "pdf.small")
+PDF_QUEUE_LARGE = os.getenv("PDF_QUEUE_LARGE", "pdf.large")
+# PDF bytes times target languages above which a document goes to the large queue
+LARGE_PDF_BYTES = int(os.getenv("LARGE_PDF_BYTES", 5 * 1024 * 1024))
+# Page chunks of sharded documents and their merge have their own queue and workers, so the many
+# chunks of one long document neither hold up small documents nor wait behind large ones
+SHARD_QUEUE = os.getenv("SHARD_QUEUE", "pdf.shard")
+
+# Longest a task may run, and how long Redis waits for an unacknowledged task before delivering it
+# again. Tasks are acknowledged late, so the timeout must stay above the limit or a long document is
+# started a second time while the first run is still going
+TASK_TIME_LIMIT = int(os.getenv("TASK_TIME_LIMIT", 8 * 3600))
+VISIBILITY_TIMEOUT = max(int(os.getenv("VISIBILITY_TIMEOUT", TASK_TIME_LIMIT + 3600)), TASK_TIME_LIMIT + 60)
+# Deliveries of a late acknowledged task before it is given up, a document that reliably kills its
+# worker is otherwise delivered again forever. Counted next to the checkpoints
+MAX_DELIVERIES = int(os.getenv("MAX_DELIVERIES", 3))
+
+app.conf.update(
+    broker_transport_options={"visibility_timeout": VISIBILITY_TIMEOUT},
+    task_time_limit=TASK_TIME_LIMIT,
+    # Pool size follows queued tasks and translation backend headroom
+    worker_autoscaler="autoscale:HeadroomAutoscaler",
+    # A process reserves one task at a time, a long document does not hold prefetched ones back
+    worker_prefetch_multiplier=1,
+)
+def s3_client():
+    # Imported and built on first use in each worker process, a client made before the prefork is not shared
+    import boto3
+    return boto3.client(
         "s3",
         endpoint_url=os.getenv("ENDPOINT"),
         aws_access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
@@ -47,28 +85,40 @@ s3 = boto3.client(
         region_name=os.getenv("S3_DEFAULT_REGION")
     )
 
+s3 = ProcessLocal(s3_client)
+# Outputs and conversions of PDFs seen before, under any key
+artifact_cache = ArtifactCache(s3) if ARTIFACT_CACHE else None
 
-def pdf_to_html(pdf_key):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Use absolute paths for input and output files
-        input_pdf = os.path.join(temp_dir, "input.pdf")
-        output_html = os.path.join(temp_dir, "output.html")
-        try:
-            start_processing = time.perf_counter()
-            s3.download_file(os.getenv("IN_BUCKET"), pdf_key, input_pdf)
-            subprocess.run(["pdf2htmlEX", "--tounicode", "1", "--optimize-text", "0", "--dest-dir", temp_dir, input_pdf, "output.html"], check=False)
-            end_processing = time.perf_counter()
-            elapsed = end_processing - start_processing
-            logger.info(f"pdf download and convertion to html in {elapsed:.2f} seconds")
-        except Exception as e:
-            print("Error during PDF to HTML conversion or S3 download:", e)
-            raise e
-        with open(output_html, "r", encoding="utf-8") as file:
-            for line in file:
-                yield line  
 
-def async_wrapper(line , from_language, to_language):
-    return asyncio.run(extract_main(line, from_language, to_language))
+def download_pdf(pdf_key, input_pdf):
+    try:
+        start_processing = time.perf_counter()
+        s3.download_file(os.getenv("IN_BUCKET"), pdf_key, input_pdf)
+        end_processing = time.perf_counter()
+        elapsed = end_processing - start_processing
+        add_stage_time("download", elapsed)
+        logger.info(f"pdf download in {elapsed:.2f} seconds")
+    except Exception as e:
+        print("Error during PDF to HTML conversion or S3 download:", e)
+        raise e
+
+
+def pdf_to_html(input_pdf, temp_dir, digest, progress=None, pages=None):
+    """Yield the html lines of a downloaded PDF, reusing an earlier conversion of the same bytes"""
+    pages = pages or count_pages(input_pdf)
+    if progress:
+        progress.set_total(pages)
+        progress.set_stage("converting")
+    cached = artifact_cache.open_conversion(digest, temp_dir) if artifact_cache else None
+    if cached is not None:
+        yield from cached
+        return
+    # Fonts and images go to the bucket once, only page markup flows on
+    assets = AssetStore(s3) if EXTERNAL_ASSETS else None
+    lines = convert_pdf(input_pdf, temp_dir, pages=pages, assets=assets)
+    if artifact_cache:
+        lines = artifact_cache.store_conversion(digest, lines, temp_dir)
+    yield from lines
 
 
 def shrink_font(css_rule, scale=0.7):
@@ -84,80 +134,421 @@ def shrink_font(css_rule, scale=0.7):
         css_rule
     )
     return new_rule
+
+def shrink_head(lines):
+    """Shrink the font rules of the document head, the pages pass through"""
+    lines = iter(lines)
+    try:
+        for line in lines:
+            if line.strip().startswith(".fs"):
+                line = shrink_font(line)
+            yield line
+            if line.strip() == PAGE_CONTAINER:
+                break
+        yield from lines
+    finally:
+        # A reader stopping early, even inside the head, stops the converter too
+        close = getattr(lines, "close", None)
+        if close:
+            close()
     
 
 
-async def main(from_language, to_language, pdf_key):
-    retries = 0
-    while retries < 10:
-        if update("TRANSLATING", pdf_key):
-            retries = 0
-            break
-        time.sleep(1)
-        retries += 1
-    # Create a temporary file with an HTML extension
-    with tempfile.NamedTemporaryFile(suffix=".html", delete=False) as tmp_file:
-        output_file = tmp_file.name
-        logger.info(f"Created temporary file: {output_file}")
-    
+@contextlib.contextmanager
+def delivery_cap(task, pdf_key=None):
+    """Count the deliveries of a task, failing it and its document once it came back MAX_DELIVERIES times
+
+    The count survives only a lost worker, a run that finishes or fails normally removes it.
+    """
+    store = checkpoint_store(s3)
+    prefix = f"deliveries-{task.request.id}"
+    try:
+        count = int(store.get(prefix, "count") or 0) + 1
+        store.put(prefix, "count", str(count))
+    except Exception as e:
+        logger.warning(f"Could not count deliveries of {task.name} {task.request.id}: {e}")
+        count = 1
     try:
-        # Write to the temporary file
-        with open(output_file, "w", encoding="utf-8") as outfile:
-            lines = pdf_to_html(pdf_key)
-            found_pages = False
-            for line in lines:
-                if line.strip().startswith(".fs"):
-                    line = shrink_font(line)
-                outfile.write(line)
-                if line.strip() == "<div id=\"page-container\">":
-                    found_pages = True
-                    break
-
-            if found_pages:       
-                # Start the processing timer
-                start_processing = time.perf_counter()
-                
-                with concurrent.futures.ThreadPoolExecutor(max_workers=32) as executor:
-                    process_with_params = partial(async_wrapper, from_language=from_language, to_language=to_language)
-                    processed_results = executor.map(process_with_params, lines)
-                    for result in processed_results:
-                        outfile.write(result)
-                
-                end_processing = time.perf_counter()
-                elapsed = end_processing - start_processing
-                logger.info(f"Translation processing completed in {elapsed:.2f} seconds")
-
-        # Generate S3 key for the output file
-        s3_output_key = os.path.splitext(pdf_key)[0] + "_" + from_language + "_to_" + to_language + ".html"
-        logger.info(f"Uploading to S3 with key: {s3_output_key}")
-        
-        # Upload the temporary file to S3
-        s3.upload_file(output_file, os.getenv("OUT_BUCKET"), s3_output_key)
+        if count > MAX_DELIVERIES:
+            logger.error(f"{task.name} {task.request.id} was delivered {count} times, its worker keeps dying")
+            if pdf_key:
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(set_status("ERROR", pdf_key))
+            # Failing acknowledges the task, a chunk fails its chord and the error callback reports it
+            raise RuntimeError(f"Gave up on {task.name} after {MAX_DELIVERIES} deliveries")
+        yield
+    finally:
+        try:
+            store.delete(prefix)
+        except Exception as e:
+            logger.warning(f"Could not remove the delivery count of {task.request.id}: {e}")
+
+def output_key(pdf_key, from_language, to_language):
+    # Generate S3 key for the output file
+    return os.path.splitext(pdf_key)[0] + "_" + from_language + "_to_" + to_language + ".html"
+
+
+async def translate_to_s3(input_pdf, temp_dir, digest, from_language, output_keys, progress, checkpoints=None, pages=None):
+    """Convert and parse a downloaded PDF once, translating and uploading it for every {to_language: key}
+
+    Returns the segments left untranslated, {to_language: set of source texts}.
+    """
+    for s3_output_key in output_keys.values():
+        logger.info(f"Streaming output to S3 with key: {s3_output_key}")
+    # Finished parts go to S3 while later pages are still being translated
+    uploaders = {
+        to_language: MultipartUploader(s3, os.getenv("OUT_BUCKET"), s3_output_key)
+        for to_language, s3_output_key in output_keys.items()
+    }
+    # Converter output is read in a thread and queued for translation, with the head shrunk on the way
+    lines = stream_in_thread(shrink_head(pdf_to_html(input_pdf, temp_dir, digest, progress, pages)))
+    translated_windows = None
+    completed = False
+    failed = {}
+
+    try:
+        found_pages = False
+        async for line in lines:
+            for uploader in uploaders.values():
+                await uploader.write(line)
+            if line.strip() == PAGE_CONTAINER:
+                found_pages = True
+                break
+
+        if found_pages:
+            # Start the processing timer
+            start_processing = time.perf_counter()
+            progress.set_stage("translating")
+
+            # Every page of the document shares this event loop
+            translated_windows = translate_document_multi(
+                lines, from_language, list(output_keys), checkpoints=checkpoints, failed=failed
+            )
+            async for results in translated_windows:
+                for to_language, translated in results.items():
+                    await uploaders[to_language].writelines(translated)
+                # Every language finishes a window together, its pages count once
+                window = next(iter(results.values()))
+                progress.add_pages(sum(1 for result in window if is_page(result)))
+
+            end_processing = time.perf_counter()
+            elapsed = end_processing - start_processing
+            add_stage_time("translate", elapsed)
+            logger.info(f"Translation processing completed in {elapsed:.2f} seconds")
+
+        progress.set_stage("uploading")
+        await asyncio.gather(*(uploader.complete() for uploader in uploaders.values()))
+        completed = True
+        return failed
+
+    finally:
+        # Windows still being translated are cancelled before the converter output goes away
+        if translated_windows is not None:
+            await translated_windows.aclose()
+        if not completed:
+            await asyncio.gather(*(uploader.abort() for uploader in uploaders.values()))
+        await lines.aclose()
+
+
+async def shard_translation(input_pdf, temp_dir, digest, from_language, output_keys, pdf_key, pages, progress, hand_off=None):
+    """Convert a long PDF here and send its page chunks to other workers, a merge task uploads the outputs
+
+    hand_off(signature, job_id) takes the chord instead of it being sent here,
+    so a task can replace itself with it.
+    """
+    store = ShardStore(s3, uuid.uuid4().hex)
+    lines = shrink_head(pdf_to_html(input_pdf, temp_dir, digest, progress, pages))
+    try:
+        chunks = await asyncio.to_thread(store.split, lines, temp_dir)
+        to_languages = list(output_keys)
+        header = group(
+            translate_chunk_task.si(store.job_id, index, from_language, to_languages, digest).set(queue=SHARD_QUEUE)
+            for index in range(chunks)
+        )
+        merge = merge_shards_task.s(store.job_id, from_language, output_keys, pdf_key, digest, pages).set(queue=SHARD_QUEUE)
+        merge = merge.on_error(shard_failed_task.si(store.job_id, pdf_key).set(queue=SHARD_QUEUE))
+        if hand_off:
+            hand_off(chord(header, merge), store.job_id)
+        else:
+            await asyncio.to_thread(chord(header), merge)
+    except BaseException:
+        # Nothing was handed off, the task fails or is retried as a whole
+        await asyncio.to_thread(store.clear)
+        raise
+    progress.set_stage("translating")
+    logger.info(f"Split {pdf_key} into {chunks} chunks of job {store.job_id}")
+
+async def translate_chunk(job_id, index, from_language, to_languages, digest):
+    """Translate one page chunk of a sharded document into every language
+
+    Returns its page count and the number of segments left untranslated per language.
+    """
+    store = ShardStore(s3, job_id)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        lines = await asyncio.to_thread(store.download, store.source_key(index), temp_dir)
+        # Chunks retried after a lost worker skip the pages they already translated
+        checkpoints = {}
+        if CHECKPOINT_ENABLED:
+            for to_language in to_languages:
+                checkpoints[to_language] = Checkpoint(checkpoint_store(s3), from_language, to_language)
+                await asyncio.to_thread(checkpoints[to_language].open, digest)
+
+        paths = {to_language: os.path.join(temp_dir, f"{to_language}.html") for to_language in to_languages}
+        files = {to_language: open(path, "w", encoding="utf-8", newline="") for to_language, path in paths.items()}
+        pages = 0
+        failed = {}
+        translated_windows = translate_document_multi(
+            lines, from_language, to_languages, checkpoints=checkpoints, failed=failed
+        )
+        try:
+            async for results in translated_windows:
+                for to_language, translated in results.items():
+                    files[to_language].writelines(translated)
+                window = next(iter(results.values()))
+                pages += sum(1 for result in window if is_page(result))
+        finally:
+            await translated_windows.aclose()
+            for file in files.values():
+                file.close()
+            await close_http_session()
+
+        for to_language, path in paths.items():
+            await asyncio.to_thread(store.upload, store.translated_key(index, to_language), path)
+    return pages, {to_language: len(texts) for to_language, texts in failed.items() if texts}
+
+async def merge_shards(chunk_results, job_id, from_language, output_keys, pdf_key, digest, pages):
+    """Upload every output of a sharded document from its head and translated chunks, in page order"""
+    store = ShardStore(s3, job_id)
+    progress = ProgressReporter(pdf_key)
+    progress.start()
+    progress.set_total(pages)
+    progress.add_pages(sum(chunk_pages for chunk_pages, _ in chunk_results))
+    failed = collections.Counter()
+    for _, chunk_failed in chunk_results:
+        failed.update(chunk_failed)
+    progress.set_stage("uploading")
+    completed = False
+
+    async def upload(to_language, s3_output_key, temp_dir):
+        uploader = MultipartUploader(s3, os.getenv("OUT_BUCKET"), s3_output_key)
+        try:
+            parts = [store.head_key()] + [store.translated_key(index, to_language) for index in range(len(chunk_results))]
+            for key in parts:
+                lines = await asyncio.to_thread(store.download, key, temp_dir)
+                await uploader.writelines(lines)
+            await uploader.complete()
+        except BaseException:
+            await uploader.abort()
+            raise
         logger.info(f"Successfully uploaded translated file to {os.getenv('OUT_BUCKET')}/{s3_output_key}")
-        
-        return s3_output_key
-    
+        if failed[to_language]:
+            # Another request for this PDF translates it again instead of copying untranslated segments
+            logger.warning(f"{failed[to_language]} segments left untranslated in {s3_output_key}, not caching it")
+        elif artifact_cache:
+            await asyncio.to_thread(
+                artifact_cache.store_result, digest, from_language, to_language, os.getenv("OUT_BUCKET"), s3_output_key
+            )
+
+    try:
+        for to_language, s3_output_key in output_keys.items():
+            # Each language in its own directory, parts share file names
+            with tempfile.TemporaryDirectory() as temp_dir:
+                await upload(to_language, s3_output_key, temp_dir)
+        if CHECKPOINT_ENABLED:
+            for to_language in output_keys:
+                checkpoint = Checkpoint(checkpoint_store(s3), from_language, to_language)
+                await asyncio.to_thread(checkpoint.open, digest)
+                await checkpoint.clear()
+        await asyncio.to_thread(store.clear)
+        completed = True
+        return output_keys
     finally:
-        while retries < 10:
-            if s3_output_key:
-                if(update("COMPLETED", pdf_key)):
-                    break
-            else:
-                if(update("ERROR", pdf_key)):
-                    break
-            time.sleep(1)
-            retries += 1
-        # Clean up the temporary file
-        if os.path.exists(output_file):
-            os.unlink(output_file)
-            logger.info(f"Removed temporary file: {output_file}")
-
-@app.task(name='python_task')
-def run_pdf_task(from_language, to_language, pdf_key):
+        progress.set_stage("done" if completed else "failed")
+        await progress.close()
+        await set_status("COMPLETED" if completed else "ERROR", pdf_key)
+
+async def translate_pdf(from_language, to_languages, pdf_key, shard=False, hand_off=None):
+    """Translate a PDF into every target language, returns {to_language: output key}
+
+    With shard set, long documents are converted here and translated in page
+    chunks by other workers, the outputs are uploaded by the merge task. The
+    keys are then returned once the chunks are queued, not written. Tasks pass
+    hand_off to replace themselves with the chord, see shard_translation.
+    """
+    # The status write retries in the background while the download starts
+    status = asyncio.ensure_future(set_status("TRANSLATING", pdf_key))
+    progress = ProgressReporter(pdf_key)
+    progress.start()
+    completed = False
+    handed_off = False
+    output_keys = {to_language: output_key(pdf_key, from_language, to_language) for to_language in to_languages}
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Use absolute paths for input and output files
+            input_pdf = os.path.join(temp_dir, "input.pdf")
+            progress.set_stage("downloading")
+            await asyncio.to_thread(download_pdf, pdf_key, input_pdf)
+            digest = await asyncio.to_thread(file_digest, input_pdf)
+
+            # The same PDF may already have been translated to some languages under another key
+            pending = {}
+            for to_language, s3_output_key in output_keys.items():
+                if not artifact_cache or not await asyncio.to_thread(
+                    artifact_cache.copy_result, digest, from_language, to_language, os.getenv("OUT_BUCKET"), s3_output_key
+                ):
+                    pending[to_language] = s3_output_key
+
+            pages = await asyncio.to_thread(count_pages, input_pdf) if pending else None
+            if pending and shard and pages and pages >= SHARD_MIN_PAGES:
+                await shard_translation(input_pdf, temp_dir, digest, from_language, pending, pdf_key, pages, progress, hand_off)
+                handed_off = True
+            elif pending:
+                # Pages translated by an earlier attempt at this document are not translated again
+                checkpoints = {}
+                if CHECKPOINT_ENABLED:
+                    for to_language in pending:
+                        checkpoints[to_language] = Checkpoint(checkpoint_store(s3), from_language, to_language)
+                        await asyncio.to_thread(checkpoints[to_language].open, digest)
+
+                failed = await translate_to_s3(input_pdf, temp_dir, digest, from_language, pending, progress, checkpoints, pages)
+                for to_language, s3_output_key in pending.items():
+                    logger.info(f"Successfully uploaded translated file to {os.getenv('OUT_BUCKET')}/{s3_output_key}")
+                    if failed.get(to_language):
+                        # Another request for this PDF translates it again instead of copying untranslated segments
+                        logger.warning(f"{len(failed[to_language])} segments left untranslated in {s3_output_key}, not caching it")
+                    elif artifact_cache:
+                        await asyncio.to_thread(
+                            artifact_cache.store_result, digest, from_language, to_language, os.getenv("OUT_BUCKET"), s3_output_key
+                        )
+                for checkpoint in checkpoints.values():
+                    await checkpoint.clear()
+
+            completed = True
+            return output_keys
+
+    finally:
+        if not handed_off:
+            progress.set_stage("done" if completed else "failed")
+        await progress.close()
+        # The final status must land after TRANSLATING, a sharded document gets it from its merge
+        await status
+        if not handed_off:
+            await set_status("COMPLETED" if completed else "ERROR", pdf_key)
+        await close_http_session()
+
+
+async def main(from_language, to_language, pdf_key):
+    output_keys = await translate_pdf(from_language, [to_language], pdf_key)
+    return output_keys[to_language]
+
+def queue_for(pdf_key, languages=1):
+    """Queue of a document by its estimated cost, the PDF size times the number of target languages"""
+    try:
+        size = s3.head_object(Bucket=os.getenv("IN_BUCKET"), Key=pdf_key)["ContentLength"]
+    except Exception as e:
+        logger.warning(f"Could not size {pdf_key}, routing it as large: {e}")
+        return PDF_QUEUE_LARGE
+    return PDF_QUEUE_SMALL if size * languages <= LARGE_PDF_BYTES else PDF_QUEUE_LARGE
+
+@app.task(name='python_task', bind=True)
+def run_pdf_task(self, from_language, to_language, pdf_key):
+    """Send a translation to the queue for its size, returns the output key once it is written
+
+    The task is replaced by the translation, so its result is the translation's.
+    """
+    queue = queue_for(pdf_key)
+    logger.info(f"Queued {pdf_key} on {queue}")
+    return self.replace(translate_pdf_task.si(from_language, to_language, pdf_key).set(queue=queue))
+
+def hand_over(task, signature, job_id, pdf_key):
+    """Replace a translation task with the chord of its sharded document, its result becomes the merge's"""
+    try:
+        return task.replace(signature)
+    except Ignore:
+        raise
+    except Exception:
+        # Nothing was sent, no merge or error callback will report the document
+        shard_failed_task(job_id, pdf_key)
+        raise
+
+# Acknowledged after it finishes, so a task lost with its worker is delivered again and resumes
+@app.task(name='pdf_translate', bind=True, acks_late=True, reject_on_worker_lost=True)
+def translate_pdf_task(self, from_language, to_language, pdf_key):
     """Celery task wrapper around async main()."""
+    with delivery_cap(self, pdf_key):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        handoffs = []
+        with trace("python_task", pdf_key=pdf_key, from_language=from_language, to_language=to_language):
+            output_keys = loop.run_until_complete(
+                translate_pdf(from_language, [to_language], pdf_key, shard=SHARDING, hand_off=lambda *handoff: handoffs.append(handoff))
+            )
+        if handoffs:
+            signature, job_id = handoffs[0]
+            return hand_over(self, signature | output_key_task.s(to_language).set(queue=SHARD_QUEUE), job_id, pdf_key)
+        return output_keys[to_language]
+
+@app.task(name='python_multi_task', bind=True)
+def run_pdf_multi_task(self, from_language, to_languages, pdf_key):
+    """Send a translation into several languages to the queue for its size, returns {to_language: output key}"""
+    # Each language once, in the order asked for
+    to_languages = list(dict.fromkeys(to_languages))
+    queue = queue_for(pdf_key, len(to_languages))
+    logger.info(f"Queued {pdf_key} into {len(to_languages)} languages on {queue}")
+    return self.replace(translate_pdf_multi_task.si(from_language, to_languages, pdf_key).set(queue=queue))
+
+@app.task(name='pdf_translate_multi', bind=True, acks_late=True, reject_on_worker_lost=True)
+def translate_pdf_multi_task(self, from_language, to_languages, pdf_key):
+    """Celery task translating one PDF into several languages, returns {to_language: output key}"""
+    with delivery_cap(self, pdf_key):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        handoffs = []
+        with trace("python_multi_task", pdf_key=pdf_key, from_language=from_language, to_languages=to_languages):
+            output_keys = loop.run_until_complete(
+                translate_pdf(from_language, to_languages, pdf_key, shard=SHARDING, hand_off=lambda *handoff: handoffs.append(handoff))
+            )
+        if handoffs:
+            signature, job_id = handoffs[0]
+            return hand_over(self, signature, job_id, pdf_key)
+        return output_keys
+
+@app.task(name='pdf_translate_chunk', bind=True, acks_late=True, reject_on_worker_lost=True)
+def translate_chunk_task(self, job_id, index, from_language, to_languages, digest):
+    """Celery task translating one page chunk of a sharded document"""
+    with delivery_cap(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        with trace("pdf_translate_chunk", job_id=job_id, index=index, from_language=from_language, to_languages=to_languages):
+            return loop.run_until_complete(translate_chunk(job_id, index, from_language, to_languages, digest))
+
+@app.task(name='pdf_merge_shards', bind=True, acks_late=True, reject_on_worker_lost=True)
+def merge_shards_task(self, chunk_results, job_id, from_language, output_keys, pdf_key, digest, pages):
+    """Celery task run once every chunk of a sharded document is translated, returns {to_language: output key}"""
+    with delivery_cap(self, pdf_key):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        with trace("pdf_merge_shards", job_id=job_id, pdf_key=pdf_key):
+            return loop.run_until_complete(merge_shards(chunk_results, job_id, from_language, output_keys, pdf_key, digest, pages))
+
+@app.task(name='pdf_output_key')
+def output_key_task(output_keys, to_language):
+    """Output key of one language from the {to_language: output key} of a merge"""
+    return output_keys[to_language]
+
+@app.task(name='pdf_shards_failed')
+def shard_failed_task(job_id, pdf_key):
+    """Error callback of a sharded document, a chunk or the merge failed"""
+    logger.error(f"Sharded translation {job_id} of {pdf_key} failed")
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    return loop.run_until_complete(main(from_language, to_language, pdf_key))
+    loop.run_until_complete(set_status("ERROR", pdf_key))
+    try:
+        ShardStore(s3, job_id).clear()
+    except Exception as e:
+        logger.warning(f"Failed to remove the chunks of {job_id}: {e}")
 
 if __name__ == "__main__":
     start = time.perf_counter()
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+from bs4 import BeautifulSoup as bs4
+
+from rewriter import FastPage, SoupPage
+
+WORDS = ["pump", "valve", "pressure", "sensor", "Temperatur", "réglage", "&amp;", "&lt;5", "&nbsp;", "&#233;t&#xe9;"]
+# Text between tags inside a segment, whitespace-only runs included
+FILLERS = ["", " ", "   ", "\n", " \n ", "\t", "&nbsp;", "<!-- c -->", "  <!-- c -->  "]
+
+PAGES = [
+    # Whitespace-only text nodes around inline spans
+    '<div id="pf1" class="pf w0 h0" data-page-no="1"><div class="pc pc1 w0 h0">'
+    '<div class="t m0 x0 h2 y0 ff1 fs0 fc0 sc0 ls0 ws0">Hello<span class="ff2">world</span>   </div>'
+    '<div class="t m0 x1 h2 y1 ff1 fs0 fc0 sc0 ls0 ws0">  <span class="_ _0">  </span>\n\n<span class="ff2">x</span></div>'
+    '</div><div class="pi" data-data=\'{"ctm":[1.0,0.0,0.0,1.0,0.0,0.0]}\'></div></div>\n',
+    # Segment divs directly below the page, a kept span and an image
+    '<div id="pf2" class="pf w0 h0" data-page-no="2">'
+    '<img class="bi x0 y0 w1 h1" alt="" src="data:image/png;base64,iVBORw0KGgo="/>'
+    '<div class="t m0 x2 h3 y2 ff1 fs1 fc0 sc0 ls0 ws0">Druck <span class="ff3 fs2 fc1 ls1">&amp; Temperatur</span> \t </div>'
+    '<div class="c x0 y0 w2 h4"><div class="t m0 x0 h2 y3 ff1"> </div><div class="t m0 x0 h2 y4 ff1">a<br>b</div></div>'
+    '</div>\n',
+]
+
+def generated_page(page_no, rng):
+    """A random page line shaped like pdf2htmlEX output"""
+    parts = [f'<div id="pf{page_no:x}" class="pf w0 h0" data-page-no="{page_no:x}"><div class="pc pc{page_no:x} w0 h0">']
+    for index in range(rng.randint(1, 12)):
+        content = []
+        for _ in range(rng.randint(1, 6)):
+            content.append(rng.choice(FILLERS))
+            if rng.random() < 0.3:
+                classes = " ".join(rng.sample(["ff1", "fs2", "fc0", "sc0", "ls1", "ws2", "_", "_1"], rng.randint(1, 5)))
+                content.append(f'<span class="{classes}">{rng.choice(FILLERS)}{rng.choice(WORDS)}</span>')
+            else:
+                content.append(rng.choice(WORDS))
+        content.append(rng.choice(FILLERS))
+        parts.append(f'<div class="t m0 x{index % 7:x} h2 y{index:x} ff1 fs0 fc0 sc0 ls0 ws0">{"".join(content)}</div>')
+    parts.append('</div><div class="pi" data-data=\'{"ctm":[1.0,0.0,0.0,1.0,0.0,0.0]}\'></div></div>\n')
+    return "".join(parts)
+
+def sample_pages():
+    rng = random.Random(7)
+    return PAGES + [generated_page(page_no, rng) for page_no in range(3, 203)]
+
+@pytest.mark.parametrize("line", sample_pages())
+def test_fast_page_matches_soup_page(line):
+    fast, soup = FastPage(line), SoupPage(line)
+    assert fast.texts == soup.texts
+
+    translations = [f"<{index}> {text.upper()} & co" for index, text in enumerate(fast.texts)]
+    # Both renderings must describe the same tree, the fast one keeps the original attribute order and quoting
+    assert str(bs4(fast.render(translations), "html.parser")) == soup.render(translations)
+
+def test_whitespace_only_text_is_collapsed():
+    page = FastPage(PAGES[0])
+    assert page.texts == ["Helloworld ", "  \nx"]
@@ -0,0 +1,237 @@
+import difflib
+import hashlib
+import logging
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+from metrics import registry
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Host-wide store of earlier translations, set TRANSLATION_MEMORY_PATH to an empty string to disable it
+TM_PATH = os.getenv("TRANSLATION_MEMORY_PATH", os.path.join(tempfile.gettempdir(), "translation_memory.sqlite3"))
+TM_MAX_ITEMS = int(os.getenv("TRANSLATION_MEMORY_ITEMS", 1000000))
+# Similarity of the number-free forms needed to reuse a translation. At 1.0 only segments differing
+# in numbers and whitespace match, lower values also reuse near-duplicates found through MinHash
+TM_THRESHOLD = float(os.getenv("TM_THRESHOLD", 1.0))
+# MinHash signature of BANDS x ROWS values, segments sharing a band are compared. Signatures are
+# only computed and stored while TM_THRESHOLD is below 1.0
+TM_BANDS = int(os.getenv("TM_BANDS", 8))
+TM_ROWS = int(os.getenv("TM_ROWS", 4))
+TM_SHINGLE = 4
+
+TM_LOOKUPS = registry.counter("translation_memory_lookups_total", "Translation memory lookups by outcome", ["result"])
+
+# Numbers are swapped for placeholders, so "Figure 12" and "Figure 13" share one entry
+NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+WHITESPACE = re.compile(r"\s+")
+SLOT = re.compile(r"\x00(\d+)\x01")
+
+# SQLite limits the number of parameters in a single statement
+SQLITE_MAX_PARAMS = 900
+
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(1)
+PERMUTATIONS = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(TM_BANDS * TM_ROWS)]
+
+def skeleton(text):
+    """Text with numbers replaced by a marker and whitespace collapsed, and the numbers in order"""
+    numbers = NUMBER.findall(text)
+    return WHITESPACE.sub(" ", NUMBER.sub("\x00", text)).strip(), numbers
+
+def template(translation, numbers):
+    """Translation with each source number replaced by its slot, None when they do not map one to one"""
+    # Repeated values could be reordered by the translation, which one went where is unknown
+    if len(set(numbers)) != len(numbers):
+        return None
+    if sorted(NUMBER.findall(translation)) != sorted(numbers):
+        return None
+    slots = {number: index for index, number in enumerate(numbers)}
+    return NUMBER.sub(lambda match: f"\x00{slots[match.group(0)]}\x01", translation)
+
+def fill(template_text, numbers):
+    return SLOT.sub(lambda match: numbers[int(match.group(1))], template_text)
+
+def signature(text):
+    """MinHash of the character shingles of a skeleton"""
+    text = text.lower()
+    shingles = {text[i:i + TM_SHINGLE] for i in range(max(1, len(text) - TM_SHINGLE + 1))}
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]
+    return [min((a * value + b) % _MERSENNE for value in hashes) for a, b in PERMUTATIONS]
+
+def band_keys(text, from_language, to_language):
+    values = signature(text)
+    keys = []
+    for band in range(TM_BANDS):
+        rows = values[band * TM_ROWS:(band + 1) * TM_ROWS]
+        raw = f"{from_language}\x1f{to_language}\x1f{band}\x1f{rows}"
+        keys.append(hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest())
+    return keys
+
+class TranslationMemory:
+    """Earlier translations reusable by segments that differ in numbers, whitespace or, below 1.0, small edits"""
+
+    def __init__(self, path=TM_PATH, threshold=TM_THRESHOLD, max_items=TM_MAX_ITEMS, prune_every=1000):
+        self.path = path
+        self.threshold = threshold
+        self.max_items = max_items
+        self.prune_every = prune_every
+        self.writes = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def connection(self):
+        # Connections must not cross a fork, so they are per process and per thread
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                "id INTEGER PRIMARY KEY, from_language TEXT NOT NULL, to_language TEXT NOT NULL, "
+                "skeleton TEXT NOT NULL, template TEXT NOT NULL, created_at REAL NOT NULL, "
+                "UNIQUE (from_language, to_language, skeleton))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS bands (band TEXT NOT NULL, segment_id INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS bands_band ON bands (band)")
+            conn.execute("CREATE INDEX IF NOT EXISTS segments_created ON segments (created_at)")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def lookup(self, texts, from_language, to_language):
+        """Translations rebuilt from earlier segments for the texts that have one, returns {text: translation}"""
+        forms = {}
+        for text in texts:
+            form, numbers = skeleton(text)
+            if form:
+                forms.setdefault(form, []).append((text, numbers))
+        if not forms:
+            return {}
+        try:
+            matches = self.exact(list(forms), from_language, to_language)
+            fuzzy = {}
+            if self.threshold < 1.0:
+                fuzzy = self.nearest([form for form in forms if form not in matches], from_language, to_language)
+        except sqlite3.Error as e:
+            logger.warning(f"Translation memory read failed: {str(e)[:100]}...")
+            return {}
+
+        found = {}
+        counts = {"exact": 0, "fuzzy": 0}
+        for form, entries in forms.items():
+            kind = "exact" if form in matches else "fuzzy"
+            template_text = matches.get(form) or fuzzy.get(form)
+            if template_text is None:
+                continue
+            slots = {int(index) for index in SLOT.findall(template_text)}
+            for text, numbers in entries:
+                # A near-duplicate may hold a different count of numbers
+                if slots == set(range(len(numbers))):
+                    found[text] = fill(template_text, numbers)
+                    counts[kind] += 1
+        for kind, count in counts.items():
+            TM_LOOKUPS.inc(count, result=kind)
+        TM_LOOKUPS.inc(len(set(texts)) - len(found), result="miss")
+        return found
+
+    def exact(self, forms, from_language, to_language):
+        found = {}
+        conn = self.connection()
+        for start in range(0, len(forms), SQLITE_MAX_PARAMS):
+            batch = forms[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT skeleton, template FROM segments WHERE from_language = ? AND to_language = ? "
+                f"AND skeleton IN ({placeholders})",
+                (from_language, to_language, *batch),
+            )
+            found.update(rows)
+        return found
+
+    def nearest(self, forms, from_language, to_language):
+        """Most similar stored skeleton at or above the threshold for each form"""
+        conn = self.connection()
+        found = {}
+        for form in forms:
+            keys = band_keys(form, from_language, to_language)
+            placeholders = ",".join("?" * len(keys))
+            rows = conn.execute(
+                f"SELECT skeleton, template FROM segments WHERE id IN "
+                f"(SELECT segment_id FROM bands WHERE band IN ({placeholders}))",
+                keys,
+            ).fetchall()
+            best, best_ratio = None, self.threshold
+            for candidate, template_text in rows:
+                ratio = difflib.SequenceMatcher(None, form, candidate).ratio()
+                if ratio >= best_ratio:
+                    best, best_ratio = template_text, ratio
+            if best is not None:
+                found[form] = best
+        return found
+
+    def add_many(self, translations, from_language, to_language):
+        """Remember {text: translation} pairs whose numbers carry over one to one"""
+        rows = {}
+        for text, translation in translations.items():
+            form, numbers = skeleton(text)
+            template_text = template(translation, numbers) if form else None
+            if template_text is not None:
+                rows[form] = template_text
+        if not rows:
+            return
+        now = time.time()
+        try:
+            conn = self.connection()
+            with conn:
+                for form, template_text in rows.items():
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO segments (from_language, to_language, skeleton, template, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (from_language, to_language, form, template_text, now),
+                    )
+                    if cursor.rowcount and self.threshold < 1.0:
+                        conn.executemany(
+                            "INSERT INTO bands (band, segment_id) VALUES (?, ?)",
+                            [(key, cursor.lastrowid) for key in band_keys(form, from_language, to_language)],
+                        )
+        except sqlite3.Error as e:
+            logger.warning(f"Translation memory write failed: {str(e)[:100]}...")
+            return
+        with self.lock:
+            self.writes += len(rows)
+            prune = self.writes >= self.prune_every
+            if prune:
+                self.writes = 0
+        if prune:
+            # A failed prune is retried after the next prune_every writes
+            try:
+                self.prune()
+            except sqlite3.Error as e:
+                logger.warning(f"Translation memory prune failed: {str(e)[:100]}...")
+
+    def prune(self):
+        """Drop the oldest segments beyond the size limit"""
+        conn = self.connection()
+        with conn:
+            count, = conn.execute("SELECT COUNT(*) FROM segments").fetchone()
+            if count > self.max_items:
+                conn.execute(
+                    "DELETE FROM segments WHERE id IN (SELECT id FROM segments ORDER BY created_at LIMIT ?)",
+                    (count - self.max_items,),
+                )
+                conn.execute("DELETE FROM bands WHERE segment_id NOT IN (SELECT id FROM segments)")
+
+    def __len__(self):
+        count, = self.connection().execute("SELECT COUNT(*) FROM segments").fetchone()
+        return count
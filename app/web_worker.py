@@ -4,9 +4,18 @@ import time
 import logging
 import subprocess
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 import uvicorn
 from dotenv import load_dotenv
 
+# Load environment variables, before metrics reads METRICS_DIR at import
+if os.path.exists('/etc/secrets/ENV_FILE'):
+    load_dotenv('/etc/secrets/ENV_FILE')
+else:
+    load_dotenv()
+
+import metrics
+
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -14,14 +23,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger("web_worker")
 
-# Load environment variables
-if os.path.exists('/etc/secrets/ENV_FILE'):
-    load_dotenv('/etc/secrets/ENV_FILE')
-else:
-    load_dotenv()
+# Celery workers to run as "name=queue,queue:min-max" separated by ";". Dispatch tasks arrive
+# on the default "celery" queue and are sent on to pdf.small or pdf.large by document size.
+# Page chunks of long documents go to pdf.shard, see SHARD_QUEUE in task.py.
+CELERY_POOLS = os.getenv(
+    "CELERY_POOLS", "small=celery,pdf.small:1-3;large=pdf.large:1-2;shard=pdf.shard:1-3"
+)
+
+def parse_pools(spec):
+    """[(name, queues, min_concurrency, max_concurrency)] of a CELERY_POOLS value"""
+    pools = []
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        name, rest = entry.split("=", 1)
+        queues, _, sizes = rest.partition(":")
+        low, _, high = (sizes or "1-2").partition("-")
+        pools.append((name.strip(), queues.strip(), int(low), int(high or low)))
+    return pools
+
+# Global variable to track the Celery process of each pool
+celery_processes = {}
+
+# Metrics of this process, never written to disk, only rendered next to the workers' snapshots
+web_metrics = metrics.Registry(directory=None)
+CELERY_UP = web_metrics.gauge("celery_worker_up", "1 while the Celery worker process is running", ["pool"])
+CELERY_RESTARTS = web_metrics.counter("celery_worker_restarts_total", "Celery worker restarts after a crash", ["pool"])
+CELERY_CHILDREN = web_metrics.gauge("celery_worker_children", "Pool processes of the Celery worker", ["pool"])
+
+def child_pids(pid):
+    """Direct children of a process, read from /proc"""
+    children = []
+    try:
+        for thread in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{thread}/children") as file:
+                children.extend(int(child) for child in file.read().split())
+    except OSError:
+        pass
+    return children
 
-# Global variable to track the Celery process
-celery_process = None
+def collect_celery_state():
+    for name, process in list(celery_processes.items()):
+        running = process.poll() is None
+        CELERY_UP.set(1 if running else 0, pool=name)
+        CELERY_CHILDREN.set(len(child_pids(process.pid)) if running else 0, pool=name)
+
+web_metrics.register_collector(collect_celery_state)
 
 # Create minimal FastAPI app
 app = FastAPI(
@@ -39,34 +84,41 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
-def run_celery_worker():
-    """Run the Celery worker with automatic restart"""
-    global celery_process
-    
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics merged from every worker process plus the worker supervisor"""
+    merged = metrics.merge(metrics.read_snapshots() + [web_metrics.snapshot()])
+    return PlainTextResponse(metrics.render(merged), media_type="text/plain; version=0.0.4")
+
+def run_celery_worker(name, queues, min_concurrency, max_concurrency):
+    """Run the Celery worker of one pool with automatic restart"""
     max_restarts = 100
     restart_count = 0
     backoff_time = 5
     
     while restart_count < max_restarts:
         try:
-            logger.info(f"Starting Celery worker (attempt {restart_count+1}/{max_restarts})")
+            logger.info(f"Starting Celery worker {name} on {queues} (attempt {restart_count+1}/{max_restarts})")
             
-            # Start Celery process
-            celery_process = subprocess.Popen([
+            # Start Celery process, its pool grows and shrinks with queued work and backend headroom
+            celery_processes[name] = subprocess.Popen([
                 "celery", "-A", "task", "worker", 
                 "--loglevel=info", 
-                "--concurrency=2",
+                "--hostname", f"{name}@%h",
+                "--queues", queues,
+                f"--autoscale={max_concurrency},{min_concurrency}",
                 "--pool=processes"
             ])
             
             # Wait for the process to terminate
-            return_code = celery_process.wait()
+            return_code = celery_processes[name].wait()
             
             if return_code == 0:
-                logger.info("Celery worker shut down normally")
+                logger.info(f"Celery worker {name} shut down normally")
                 break
             
-            logger.warning(f"Celery worker crashed with code {return_code}")
+            logger.warning(f"Celery worker {name} crashed with code {return_code}")
+            CELERY_RESTARTS.inc(pool=name)
             restart_count += 1
             time.sleep(backoff_time)
             backoff_time = min(backoff_time * 2, 60)
@@ -80,9 +132,14 @@ def main():
     """Run both web server and Celery worker"""
     logger.info("Starting PDF processing service...")
     
-    # Start Celery worker in a thread
-    celery_thread = threading.Thread(target=run_celery_worker, daemon=True)
-    celery_thread.start()
+    # Rate limits are per process, each worker process takes its share of the host's limit
+    pools = parse_pools(CELERY_POOLS)
+    os.environ.setdefault("WORKER_PROCESSES", str(sum(high for _, _, _, high in pools)))
+
+    # Start a Celery worker per pool, each in a thread
+    for pool in pools:
+        celery_thread = threading.Thread(target=run_celery_worker, args=pool, daemon=True)
+        celery_thread.start()
     
     # Run web server in main thread
     port = int(os.environ.get("PORT", 8000))